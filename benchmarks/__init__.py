@@ -0,0 +1,9 @@
+"""
+Benchmarks for html_bitmap: drawing primitives, to_html on flat, striped and
+noisy canvases, and the use_case_x.py workloads.
+
+	python -m benchmarks                       # run all, print a table
+	python -m benchmarks -o base.json          # ... and save the results
+	python -m benchmarks compare base.json     # run again, flag regressions
+	python -m benchmarks compare base.json new.json
+"""
@@ -0,0 +1,99 @@
+"""
+Runs the benchmarks, saves them as JSON and compares them with a baseline.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import timeit
+
+from benchmarks.cases import all_cases
+
+
+def measure(setup, repeat):
+	''' Best time of one call, in seconds. Fast functions are called in
+		batches big enough to be timed, slow ones once per repeat. '''
+	timer = timeit.Timer(setup())
+	number, total = timer.autorange()
+	if total > 1.0:
+		return min([total / number] + [t / number for t in timer.repeat(max(repeat - 2, 0), number)])
+	return min(t / number for t in timer.repeat(repeat, number))
+
+
+def run(pattern="", quick=False, repeat=5):
+	results = {}
+	for (name, setup) in all_cases(quick):
+		if pattern not in name:
+			continue
+		try:
+			results[name] = measure(setup, repeat)
+			print("%-32s %10.3f ms" % (name, results[name] * 1e3))
+		except Exception as e:	# a broken workload is reported, not fatal
+			results[name] = None
+			print("%-32s %13s  (%s: %s)" % (name, "failed", type(e).__name__, e))
+		sys.stdout.flush()
+	return {
+		"python": platform.python_version(),
+		"machine": platform.machine(),
+		"time": time.strftime("%Y-%m-%d %H:%M:%S"),
+		"results": results,
+	}
+
+
+def compare(base, new, threshold):
+	''' Prints both timings side by side. Returns the number of cases that
+		got slower by more than 'threshold' times. '''
+	slower = 0
+	for name in sorted(set(base["results"]) | set(new["results"])):
+		b = base["results"].get(name)
+		n = new["results"].get(name)
+		if b is None or n is None:
+			print("%-32s %10s %10s" % (name, "-" if b is None else "%.3f" % (b * 1e3), "-" if n is None else "%.3f" % (n * 1e3)))
+			continue
+		flag = ""
+		if n > b * threshold:
+			flag = "  REGRESSION"
+			slower += 1
+		elif b > n * threshold:
+			flag = "  faster"
+		print("%-32s %10.3f %10.3f  x%.2f%s" % (name, b * 1e3, n * 1e3, n / b, flag))
+	return slower
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="python -m benchmarks")
+	parser.add_argument("command", nargs="?", default="run", choices=["run", "compare"])
+	parser.add_argument("files", nargs="*", help="compare: baseline.json [current.json]")
+	parser.add_argument("-o", "--output", help="save the results of this run as JSON")
+	parser.add_argument("-k", "--filter", default="", help="only cases with this in their name")
+	parser.add_argument("-r", "--repeat", type=int, default=5)
+	parser.add_argument("--quick", action="store_true", help="smaller canvases, no use cases")
+	parser.add_argument("--threshold", type=float, default=1.2, help="slowdown that counts as a regression")
+	args = parser.parse_args(argv)
+
+	if args.command == "compare" and not 1 <= len(args.files) <= 2:
+		parser.error("compare needs a baseline file and optionally a results file")
+	if args.command == "compare" and len(args.files) == 2:
+		with open(args.files[1]) as f:
+			new = json.load(f)
+	else:
+		new = run(args.filter, args.quick, args.repeat)
+	if args.output:
+		with open(args.output, "w") as f:
+			json.dump(new, f, indent=1, sort_keys=True)
+
+	if args.command == "compare":
+		with open(args.files[0]) as f:
+			base = json.load(f)
+		print("")
+		print("%-32s %10s %10s" % ("case, ms", "baseline", "current"))
+		slower = compare(base, new, args.threshold)
+		if slower:
+			print("%d regression(s) over x%.2f" % (slower, args.threshold))
+			return 1
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+The benchmark cases. Every case is a (name, setup) pair, where setup() builds
+what is needed and returns the function to time.
+"""
+import io
+import os
+import random
+import runpy
+import sys
+
+import html_bitmap as hb
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def flat(n):
+	bmp = hb.new_bitmap(n, n, "#fff")
+	hb.rect_on(bmp, n//4, n//4, n//2, n//2, "#00f")
+	return bmp
+
+def striped(n):
+	bmp = hb.new_bitmap(n, n, "#fff")
+	for x in range(0, n, 4):
+		hb.rect_on(bmp, x, 0, 2, n, "#ccc")
+	for y in range(0, n, 8):
+		hb.rect_on(bmp, 0, y, n, 1, "#888")
+	return bmp
+
+def noise(n):
+	rnd = random.Random(n)
+	colors = ["#000", "#f00", "#0f0", "#00f", "#fff"]
+	bmp = hb.new_bitmap(n, n)
+	for y in range(n):
+		for x in range(n):
+			hb.pixel_on(bmp, x, y, rnd.choice(colors))
+	return bmp
+
+CANVASES = {"flat": flat, "striped": striped, "noise": noise}
+
+
+def drawing_cases():
+	def new_bitmap():
+		return lambda: hb.new_bitmap(1000, 1000)
+	yield "new_bitmap 1000x1000", new_bitmap
+
+	def pixel_on():
+		bmp = hb.new_bitmap(256, 256)
+		points = [(x, y) for y in range(0, 256, 4) for x in range(0, 256, 4)]
+		def run():
+			for (x, y) in points:
+				hb.pixel_on(bmp, x, y, "#f00")
+		return run
+	yield "pixel_on 4096 calls", pixel_on
+
+	def rect_on():
+		bmp = hb.new_bitmap(512, 384)
+		def run():
+			hb.rect_on(bmp, 0, 0, 512, 384, "#888")
+			hb.rect_on(bmp, 20, 20, 236, 344, "#800")
+		return run
+	yield "rect_on 512x384 + panel", rect_on
+
+	for width in (1, 2, 5, 15):
+		def line_on(width=width):
+			bmp = hb.new_bitmap(512, 384)
+			return lambda: hb.line_on(bmp, 0, 0, 511, 300, "#0f0", width)
+		yield "line_on width %d" % width, line_on
+
+	for (r, width) in ((50, 2), (150, 4), (400, 10)):
+		def circle_on(r=r, width=width):
+			bmp = hb.new_bitmap(1000, 1000)
+			return lambda: hb.circle_on(bmp, 500, 500, r, "#f00", width)
+		yield "circle_on r=%d width=%d" % (r, width), circle_on
+
+
+def to_html_cases(sizes):
+	for kind in sorted(CANVASES):
+		for n in sizes:
+			def to_html(kind=kind, n=n):
+				bmp = CANVASES[kind](n)
+				return lambda: hb.to_html(bmp)
+			yield "to_html %s %dx%d" % (kind, n, n), to_html
+
+
+def use_case_cases():
+	for name in ("use_case_1", "use_case_2", "use_case_3"):
+		def use_case(name=name):
+			path = os.path.join(ROOT, name + ".py")
+			def run():
+				out = sys.stdout
+				sys.stdout = io.StringIO()
+				try:
+					runpy.run_path(path, run_name="__main__")
+				finally:
+					sys.stdout = out
+			return run
+		yield name, use_case
+
+
+def all_cases(quick=False):
+	sizes = (64, 256) if quick else (64, 256, 512)
+	for case in drawing_cases():
+		yield case
+	for case in to_html_cases(sizes):
+		yield case
+	if not quick:
+		for case in use_case_cases():
+			yield case
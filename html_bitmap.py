@@ -1,192 +1,1487 @@
 #!/usr/bin/python
+import base64
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import groupby
+from operator import ne
+from time import perf_counter
+
+__all__ = ["to_hex", "to_hex_many", "Colormap", "new_bitmap", "Bitmap", "MappedBitmap", "Canvas", "BAND",
+	"blit", "pixel_on", "rect_on", "hspan_on", "line_on", "polyline_on", "plot_function", "field_on", "circle_on", "disc_on",
+	"to_html", "downsample", "iter_html", "write_html", "HtmlRenderer", "iter_html_parallel", "to_html_parallel",
+	"to_png_bytes", "iter_png", "write_png", "to_svg", "RenderStats"]	# what "from html_bitmap import *" gives
+
+_numpy = None	# optional, imported by the first new_bitmap(..., backend="numpy")
+
+_hex_cache = {}	# 0xRRGGBB -> its string, so every color is formatted once and shared
 
 def to_hex(r, g, b):
 	ir = 0 if r<0 else 255 if r>255 else int(r)
-	ig = 0 if r<0 else 255 if r>255 else int(g)
-	ib = 0 if r<0 else 255 if r>255 else int(b)
-	if ir%16==0 and ig%16==0 and ib%16==0:
-		if ir==ig and ir==ib:
-			return '#%01x' % int(ir/16)
-		return '#%01x%01x%01x' % (int(ir/16), int(ig/16), int(ib/16))
-	return '#%02x%02x%02x' % (ir, ig, ib)
+	ig = 0 if g<0 else 255 if g>255 else int(g)
+	ib = 0 if b<0 else 255 if b>255 else int(b)
+	key = (ir << 16) | (ig << 8) | ib
+	s = _hex_cache.get(key)
+	if s is None:
+		if ir%16==0 and ig%16==0 and ib%16==0:
+			if ir==ig and ir==ib:
+				s = '#%01x' % int(ir/16)
+			else:
+				s = '#%01x%01x%01x' % (int(ir/16), int(ig/16), int(ib/16))
+		else:
+			s = '#%02x%02x%02x' % (ir, ig, ib)
+		_hex_cache[key] = s
+	return s
+
+def to_hex_many(rgbs):	# [to_hex(r, g, b) for (r, g, b) in rgbs], for integer channels mostly a dict lookup each
+	cache = _hex_cache
+	ret = []
+	for (r, g, b) in rgbs:
+		if r.__class__ is int and g.__class__ is int and b.__class__ is int and 0 <= r < 256 and 0 <= g < 256 and 0 <= b < 256:
+			s = cache.get((r << 16) | (g << 8) | b)
+			if s is not None:
+				ret.append(s)
+				continue
+		ret.append(to_hex(r, g, b))
+	return ret
+
+class Colormap(object):	# maps scalars from lo..hi to n shared color strings
+	__slots__ = ('lo', 'hi', 'colors', 'scale')
+
+	def __init__(self, stops, lo=0.0, hi=1.0, n=256):	# stops: (r, g, b) list spread evenly, or a function of 0..1
+		if not callable(stops):
+			stops = _ramp(stops)
+		self.lo = lo
+		self.hi = hi
+		self.colors = [to_hex(*stops(k / float(n - 1) if n > 1 else 0.0)) for k in range(n)]
+		self.scale = n / float(hi - lo) if hi != lo else 0.0
+
+	def __call__(self, v):
+		k = int((v - self.lo) * self.scale)
+		n = len(self.colors)
+		return self.colors[0 if k < 0 else n - 1 if k >= n else k]
+
+	def many(self, vs):
+		lo = self.lo
+		scale = self.scale
+		colors = self.colors
+		top = len(colors) - 1
+		ret = []
+		for v in vs:
+			k = int((v - lo) * scale)
+			ret.append(colors[0 if k < 0 else top if k > top else k])
+		return ret
+
+def _ramp(stops):	# piecewise linear function of 0..1 through the stops
+	stops = [tuple(s) for s in stops]
+	def f(t):
+		if len(stops) == 1:
+			return stops[0]
+		t *= len(stops) - 1
+		k = min(int(t), len(stops) - 2)
+		t -= k
+		return tuple(a + (b - a) * t for (a, b) in zip(stops[k], stops[k + 1]))
+	return f
+
+BAND = 16	# rows in a band: Canvas rasterizes and HtmlRenderer redoes the bitmap band by band
+
+def _import_numpy():
+	global _numpy
+	if _numpy is None:
+		try:
+			import numpy as _numpy
+		except ImportError:
+			raise ImportError("backend='numpy' needs NumPy installed")
+
+class Bitmap(object):	# flat array of palette indices, row after row
+	__slots__ = ('w', 'h', 'data', 'palette', 'index', 'x0', 'y0', 'stride', 'origin')
+
+	def __init__(self, w, h, col="", backend="array"):	# backend "numpy" keeps the indices in an ndarray
+		self.w = w
+		self.h = h
+		self.palette = [""]	# index -> color
+		self.index = {"": 0}	# color -> index
+		if backend == "array":
+			self.data = array('H', [self.color_index(col)]) * (w*h)
+		elif backend == "numpy":
+			_import_numpy()
+			self.data = _numpy.full(w*h, self.color_index(col), dtype=_numpy.uint16)
+		else:
+			raise ValueError("Unknown bitmap backend: " + repr(backend))
+		self.x0 = 0	# pixel (x, y) is data[(y0 + y)*stride + x0 + x], a view shares data with another offset
+		self.y0 = 0
+		self.stride = w
+		self.origin = 0	# (y0*stride + x0), where pixel (0, 0) is
+
+	def color_index(self, col):
+		i = self.index.get(col)
+		if i is None:
+			i = len(self.palette)
+			if i > 0xFFFF:
+				raise ValueError("Bitmap palette is limited to 65536 colors")
+			self.palette.append(col)
+			self.index[col] = i
+		return i
+
+	def get(self, x, y):
+		return self.palette[self.data[(self.y0 + y)*self.stride + self.x0 + x]]
+
+	def row(self, y):
+		palette = self.palette
+		base = (self.y0 + y)*self.stride + self.x0
+		return [palette[i] for i in self.data[base:base + self.w]]
+
+	def view(self, x, y, w, h):	# the window at (x, y) clipped to the bitmap, sharing its pixels and palette
+		x1 = min(max(int(x), 0), self.w)
+		y1 = min(max(int(y), 0), self.h)
+		v = Bitmap.__new__(Bitmap)
+		v.w = min(max(int(x + w), x1), self.w) - x1
+		v.h = min(max(int(y + h), y1), self.h) - y1
+		v.data = self.data
+		v.palette = self.palette
+		v.index = self.index
+		v.x0 = self.x0 + x1
+		v.y0 = self.y0 + y1
+		v.stride = self.stride
+		v.origin = v.y0*v.stride + v.x0
+		return v
+
+	def to_rows(self):
+		return [self.row(y) for y in range(self.h)]
+
+	@classmethod
+	def from_rows(cls, rows):
+		bitmap = cls(len(rows[0]) if rows else 0, len(rows))
+		data = bitmap.data
+		color_index = bitmap.color_index
+		k = 0
+		for cline in rows:
+			for c in cline:
+				data[k] = color_index(c)
+				k += 1
+		return bitmap
+
+
+class MappedBitmap(Bitmap):	# a Bitmap with its indices in a memory-mapped file and its palette in path + ".json"
+	__slots__ = ('path', 'file', 'map')
+
+	def __init__(self, path, w=None, h=None, col=""):	# opens the bitmap at path, or makes a new w x h one there
+		self.path = path
+		self.palette = [""]
+		self.index = {"": 0}
+		if (w is None) != (h is None):
+			raise ValueError("MappedBitmap needs both w and h for a new bitmap, or neither to open one")
+		if w is None and col != "":
+			raise ValueError("MappedBitmap(path) opens the bitmap as it is, col is only for a new one")
+		new = w is not None
+		if not new:
+			with open(path + ".json") as fp:
+				meta = json.load(fp)
+			if meta["byteorder"] != sys.byteorder:
+				raise ValueError("MappedBitmap was written with " + meta["byteorder"] + "-endian indices")
+			w = meta["w"]
+			h = meta["h"]
+			for c in meta["palette"][1:]:
+				self.color_index(c)
+			self.file = open(path, "r+b")
+			if os.fstat(self.file.fileno()).st_size != 2*w*h:
+				self.file.close()
+				raise ValueError("MappedBitmap file " + repr(path) + " does not hold " + str(w) + "x" + str(h) + " indices")
+		else:
+			self.file = open(path, "w+b")
+			self.file.truncate(2*w*h)	# all zeros, that is all ""
+		self.w = w
+		self.h = h
+		self.x0 = 0
+		self.y0 = 0
+		self.stride = w
+		self.origin = 0
+		self.map = mmap.mmap(self.file.fileno(), 0) if w*h else None	# an empty file cannot be mapped
+		self.data = memoryview(self.map).cast('H') if w*h else array('H')
+		i = self.color_index(col) if new else 0
+		if i:
+			row = array('H', [i]) * w
+			for y in range(h):	# a row at a time, the whole thing may not fit in memory
+				self.data[y*w:(y+1)*w] = row
+		self.flush()
+
+	def flush(self):	# writes the pixels and the palette to disk
+		if self.map is not None:
+			self.map.flush()
+		with open(self.path + ".json", "w") as fp:
+			json.dump({"w": self.w, "h": self.h, "byteorder": sys.byteorder, "palette": self.palette}, fp)
+
+	def close(self):
+		if self.file.closed:
+			return
+		self.flush()
+		if self.map is not None:
+			self.data.release()
+			self.map.close()
+		self.file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+_stats = None	# the RenderStats being filled, None costs the primitives one comparison
+_tally = None	# the same stats while a primitive runs, for counting pixels where they are written
+
+class RenderStats(object):	# with RenderStats() as stats: counts and times what gets drawn and written inside
+	__slots__ = ('pixels', 'clipped', 'primitives', 'cells', 'covered', 'bytes', 'time', 'outer')
+
+	def __init__(self):
+		self.pixels = 0	# pixels drawn inside the bitmap
+		self.clipped = 0	# pixels drawn outside it
+		self.primitives = {}	# drawing function -> calls
+		self.cells = 0	# <td>s written by iter_html
+		self.covered = 0	# pixels those cells cover
+		self.bytes = 0	# characters of html written
+		self.time = {"draw": 0.0, "merge": 0.0, "html": 0.0}	# seconds, a Canvas is rasterized in "merge"
+		self.outer = None
+
+	def __enter__(self):
+		global _stats
+		self.outer = _stats
+		_stats = self
+		return self
+
+	def __exit__(self, *exc):
+		global _stats
+		_stats = self.outer
+		self.outer = None
+
+	@property
+	def ratio(self):	# cells per pixel, 1.0 is no merging at all
+		return self.cells / self.covered if self.covered else 0.0
+
+	def __repr__(self):
+		return "RenderStats(pixels=%d, clipped=%d, primitives=%r, cells=%d, ratio=%.4f, bytes=%d, time={%s})" % (
+			self.pixels, self.clipped, self.primitives, self.cells, self.ratio, self.bytes,
+			", ".join("%r: %.6f" % kv for kv in self.time.items()))
 
-def new_bitmap(w, h, col=""):
-	return [[col for j in range(w)] for i in range(h)]
+	def draw(self, f, args):	# runs a primitive, counted once however it is drawn
+		global _stats, _tally
+		name = f.__name__
+		self.primitives[name] = self.primitives.get(name, 0) + 1
+		t = perf_counter()
+		written = self.pixels
+		_stats = None
+		_tally = self
+		try:
+			return f(*args)	# adds all its pixels to clipped, clipped or not
+		finally:
+			_stats = self
+			_tally = None
+			self.clipped -= self.pixels - written
+			self.time["draw"] += perf_counter() - t
+
+	def pixel(self, args):
+		bitmap, x, y = args[:3]
+		x = int(x)
+		y = int(y)
+		if type(bitmap) is list:
+			inside = 0 <= y < len(bitmap) and 0 <= x < len(bitmap[y])
+		else:
+			inside = 0 <= y < bitmap.h and 0 <= x < bitmap.w
+		if inside:
+			self.pixels += 1
+		else:
+			self.clipped += 1
+		self.draw(pixel_on, args)
+
+	def spans(self, spans, W, H):	# passes the spans through, counting their pixels inside W x H
+		for s in spans:
+			(y, x1, x2) = s
+			if 0 <= y < H and x1 < W and x2 > 0:
+				self.pixels += min(x2, W) - max(x1, 0)
+			yield s
+
+	def html(self, head, rows, attrs, tr):	# iter_html after the head, the merge timed apart from the strings
+		clock = perf_counter
+		self.bytes += len(head) + len("</table>")
+		time = self.time
+		t0 = clock()
+		for cells in rows:
+			t1 = clock()
+			row = _tr(cells, attrs, tr)
+			time["merge"] += t1 - t0
+			time["html"] += clock() - t1
+			self.cells += len(cells)
+			self.covered += sum(c[1] * c[2] for c in cells)
+			self.bytes += len(row)
+			yield row
+			t0 = clock()
+		time["merge"] += clock() - t0
+		yield "</table>"
+
+def new_bitmap(w, h, col="", backend="array"):
+	return Bitmap(w, h, col, backend)
+
+def _is_ndarray(data):
+	np = sys.modules.get("numpy")	# looked up, not imported: there is no ndarray without it
+	return np is not None and isinstance(data, np.ndarray)
+
+def _is_view(bitmap):	# a window into another bitmap's data
+	return bitmap.stride != bitmap.w or bitmap.x0 != 0 or bitmap.y0 != 0 or len(bitmap.data) != bitmap.w * bitmap.h
+
+def _grid(bitmap):	# the pixels of an ndarray bitmap as a 2D view, not for empty bitmaps
+	return bitmap.data.reshape(-1, bitmap.stride)[bitmap.y0:bitmap.y0 + bitmap.h, bitmap.x0:bitmap.x0 + bitmap.w]
 
 def pixel_on(bitmap, x, y, col=""):
+	if type(bitmap) is Bitmap and _stats is None:	# the common case, kept short
+		if x.__class__ is not int:
+			x = int(x)
+		if y.__class__ is not int:
+			y = int(y)
+		if 0 <= x < bitmap.w and 0 <= y < bitmap.h:
+			try:
+				bitmap.data[bitmap.origin + y*bitmap.stride + x] = bitmap.index[col]
+			except KeyError:
+				bitmap.data[bitmap.origin + y*bitmap.stride + x] = bitmap.color_index(col)
+		return
+	if _stats is not None:
+		return _stats.pixel((bitmap, x, y, col))
 	x = int(x)
 	y = int(y)
-	if y < len(bitmap) and y >= 0:
-		if x < len(bitmap[y]) and x >= 0:
-			bitmap[y][x] = col
+	if type(bitmap) is list:	# plain list of lists
+		if y < len(bitmap) and y >= 0:
+			if x < len(bitmap[y]) and x >= 0:
+				bitmap[y][x] = col
+	elif type(bitmap) is Canvas:
+		bitmap.add(((y, x, x + 1),), col)
+	elif 0 <= y < bitmap.h:
+		if 0 <= x < bitmap.w:
+			bitmap.data[(bitmap.y0 + y)*bitmap.stride + bitmap.x0 + x] = bitmap.color_index(col)
 
-def rect_on(bitmap, x, y, w, h, col=""):
-	for i in range(int(y), int(y+h)):
-		for j in range(int(x), int(x+w)):
-			pixel_on(bitmap, j, i, col)
+def _size(bitmap):
+	if type(bitmap) is list:
+		return (len(bitmap[0]) if bitmap else 0), len(bitmap)
+	return bitmap.w, bitmap.h
 
-def line_on(bitmap, x1, y1, x2, y2, col="", width=1):	# Bresenham's
+def _spans_on(bitmap, spans, col):	# fills half-open (y, x1, x2) spans, clipped to the bitmap
+	if _tally is not None:
+		spans = _tally.spans(spans, *_size(bitmap))
+	if type(bitmap) is list:
+		H = len(bitmap)
+		for (y, x1, x2) in spans:
+			if 0 <= y < H:
+				row = bitmap[y]
+				if x1 < 0:
+					x1 = 0
+				if x2 > len(row):
+					x2 = len(row)
+				if x1 < x2:
+					row[x1:x2] = [col] * (x2 - x1)
+		return
+	if type(bitmap) is Canvas:
+		bitmap.add(spans, col)
+		return
+	data = bitmap.data
+	w = bitmap.w
+	h = bitmap.h
+	x0 = bitmap.x0
+	y0 = bitmap.y0
+	stride = bitmap.stride
+	i = bitmap.color_index(col)
+	fill = array('H', [i])
+	scalar = _is_ndarray(data)	# numpy broadcasts the index itself
+	for (y, x1, x2) in spans:
+		if 0 <= y < h:
+			if x1 < 0:
+				x1 = 0
+			if x2 > w:
+				x2 = w
+			if x1 < x2:
+				base = (y0 + y)*stride + x0
+				data[base + x1:base + x2] = i if scalar else fill * (x2 - x1)
+
+def hspan_on(bitmap, x1, x2, y, col=""):	# from x1 to x2 inclusive
+	if _stats is not None:
+		return _stats.draw(hspan_on, (bitmap, x1, x2, y, col))
 	x1 = int(x1)
-	y1 = int(y1)
 	x2 = int(x2)
-	y2 = int(y2)
-	points = []
+	if x1 > x2:
+		x1, x2 = x2, x1
+	if _tally is not None:
+		_tally.clipped += x2 + 1 - x1
+	_spans_on(bitmap, ((int(y), x1, x2 + 1),), col)
+
+def rect_on(bitmap, x, y, w, h, col=""):
+	if _stats is not None:
+		return _stats.draw(rect_on, (bitmap, x, y, w, h, col))
+	W, H = _size(bitmap)
+	x1 = max(int(x), 0)
+	x2 = min(int(x+w), W)
+	y1 = max(int(y), 0)
+	y2 = min(int(y+h), H)
+	if _tally is not None:
+		_tally.clipped += max(int(x+w) - int(x), 0) * max(int(y+h) - int(y), 0)
+	if x1 >= x2 or y1 >= y2:
+		return
+	if isinstance(bitmap, Bitmap):
+		if _is_ndarray(bitmap.data):
+			_grid(bitmap)[y1:y2, x1:x2] = bitmap.color_index(col)
+			if _tally is not None:
+				_tally.pixels += (x2 - x1) * (y2 - y1)
+			return
+		if x1 == 0 and x2 == W and bitmap.stride == W:	# whole rows are one slice
+			base = (bitmap.y0 + y1)*W
+			bitmap.data[base:base + (y2 - y1)*W] = array('H', [bitmap.color_index(col)]) * ((y2 - y1) * W)
+			if _tally is not None:
+				_tally.pixels += (x2 - x1) * (y2 - y1)
+			return
+	_spans_on(bitmap, ((i, x1, x2) for i in range(y1, y2)), col)
+
+def _bresenham_spans(x1, y1, x2, y2):	# Bresenham's, a span per run of pixels on a row
 	step = abs(y2-y1) > abs(x2-x1)
 	if step:
 		x1, y1 = y1, x1
 		x2, y2 = y2, x2
 
-	rev = False
 	if x1 > x2:
 		x1, x2 = x2, x1
 		y1, y2 = y2, y1
-		rev = True
 	deltax = x2 - x1
 	deltay = abs(y2-y1)
 	error = int(deltax / 2)
 	y = y1
-	ystep = None
 	if y1 < y2:
 		ystep = 1
 	else:
 		ystep = -1
+	if step:
+		for x in range(x1, x2 + 1):
+			yield x, y, y + 1
+			error -= deltay
+			if error < 0:
+				y += ystep
+				error += deltax
+		return
+	start = x1
 	for x in range(x1, x2 + 1):
-		if step:
-			points.append((y, x))
-		else:
-			points.append((x, y))
 		error -= deltay
 		if error < 0:
+			yield y, start, x + 1
+			start = x + 1
 			y += ystep
 			error += deltax
-			
-	if rev:
-		points.reverse()
+	if start <= x2:
+		yield y, start, x2 + 1
+
+def _thick_line_spans(x1, y1, x2, y2, width, cap, H):	# one span per row of the swept shape
+	# a pixel is in if its corner point (x, y) is in the shape, left and top edges inclusive
+	hw = width / 2.0
+	dx = x2 - x1
+	dy = y2 - y1
+	l = math.hypot(dx, dy)
+	if l == 0:
+		if cap == "round":
+			return _disc_spans(x1, y1, hw, H)
+		return ((y, int(math.ceil(x1 - hw)), int(math.ceil(x1 + hw))) for y in _rows(y1 - hw, y1 + hw, H))
+	ux = dx / l * hw
+	uy = dy / l * hw
+	if cap == "square":
+		x1, y1, x2, y2 = x1 - ux, y1 - uy, x2 + ux, y2 + uy
+	elif cap != "round" and cap != "butt":
+		raise ValueError("Unknown line cap: " + repr(cap))
+	quad = [(x1 - uy, y1 + ux), (x2 - uy, y2 + ux), (x2 + uy, y2 - ux), (x1 + uy, y1 - ux)]
+	edges = [(quad[k], quad[k-1]) for k in range(4) if quad[k][1] != quad[k-1][1]]
+	ys = [p[1] for p in quad]
+	top = min(ys)
+	bottom = max(ys)
+	if cap == "round":
+		top = min(top, y1 - hw, y2 - hw)
+		bottom = max(bottom, y1 + hw, y2 + hw)
+	return _convex_spans(edges, top, bottom, H, ((x1, y1), (x2, y2)) if cap == "round" else (), hw)
+
+def _rows(top, bottom, H):	# rows y with top <= y < bottom, clipped to [0, H) unless H is None
+	if H is None:
+		return range(int(math.ceil(top)), int(math.ceil(bottom)))
+	return range(max(int(math.ceil(top)), 0), min(int(math.ceil(bottom)), H))
+
+def _convex_spans(edges, top, bottom, H, discs=(), r=0):	# edges of a convex polygon, union discs of radius r
+	for y in _rows(top, bottom, H):
+		xl = None
+		for ((ax, ay), (bx, by)) in edges:
+			if ay <= y <= by or by <= y <= ay:
+				x = ax + (bx - ax) * (y - ay) / (by - ay)
+				if xl is None:
+					xl = xr = x
+				elif x < xl:
+					xl = x
+				elif x > xr:
+					xr = x
+		for (cx, cy) in discs:
+			d = r*r - (y - cy)*(y - cy)
+			if d > 0:
+				d = math.sqrt(d)
+				if xl is None:
+					xl, xr = cx - d, cx + d
+				else:
+					xl = min(xl, cx - d)
+					xr = max(xr, cx + d)
+		if xl is not None:
+			yield y, int(math.ceil(xl)), int(math.ceil(xr))
+
+def _disc_spans(cx, cy, r, H):
+	for y in _rows(cy - r, cy + r, H):
+		d = math.sqrt(max(r*r - (y - cy)*(y - cy), 0))
+		yield y, int(math.ceil(cx - d)), int(math.ceil(cx + d))
 
-	for (x, y) in points:
+def line_on(bitmap, x1, y1, x2, y2, col="", width=1, cap="square"):	# cap is "square", "round" or "butt"
+	if _stats is not None:
+		return _stats.draw(line_on, (bitmap, x1, y1, x2, y2, col, width, cap))
+	x1 = int(x1)
+	y1 = int(y1)
+	x2 = int(x2)
+	y2 = int(y2)
+	if _tally is not None:	# the whole line, nothing clipped
+		spans = _bresenham_spans(x1, y1, x2, y2) if width == 1 else _thick_line_spans(x1, y1, x2, y2, width, cap, None)
+		_tally.clipped += sum(s[2] - s[1] for s in spans)
+	if width == 1:
+		_spans_on(bitmap, _bresenham_spans(x1, y1, x2, y2), col)
+	else:
+		_spans_on(bitmap, _thick_line_spans(x1, y1, x2, y2, width, cap, _size(bitmap)[1]), col)
+
+def _segments_spans(points, width, cap, H):	# spans of the lines between consecutive points, None lifts the pen
+	for k in range(1, len(points)):
+		a = points[k - 1]
+		b = points[k]
+		if a is None or b is None:
+			continue
 		if width == 1:
-			pixel_on(bitmap, x, y, col)
+			for span in _bresenham_spans(a[0], a[1], b[0], b[1]):
+				yield span
 		else:
-			rect_on(bitmap, x-width/2, y-width/2, width, width, col)
+			for span in _thick_line_spans(a[0], a[1], b[0], b[1], width, cap, H):
+				yield span
+	if len(points) == 1 and points[0] is not None:	# a lone point is a line from it to itself
+		for span in _segments_spans(points * 2, width, cap, H):
+			yield span
+
+def _merged(spans):	# the union of the spans, one span per run of a row, rows in order
+	rows = {}
+	for (y, x1, x2) in spans:
+		if x1 < x2:
+			rows.setdefault(y, []).append((x1, x2))
+	for y in sorted(rows):
+		row = sorted(rows[y])
+		(a, b) = row[0]
+		for (x1, x2) in row[1:]:
+			if x1 > b:
+				yield y, a, b
+				(a, b) = (x1, x2)
+			elif x2 > b:
+				b = x2
+		yield y, a, b
+
+def polyline_on(bitmap, points, col="", width=1, cap="square"):	# the lines between consecutive (x, y) points, drawn as one shape
+	if _stats is not None:
+		return _stats.draw(polyline_on, (bitmap, points, col, width, cap))
+	points = [None if p is None else (int(p[0]), int(p[1])) for p in points]
+	if _tally is not None:	# the whole polyline, nothing clipped
+		_tally.clipped += sum(s[2] - s[1] for s in _merged(_segments_spans(points, width, cap, None)))
+	_spans_on(bitmap, _merged(_segments_spans(points, width, cap, _size(bitmap)[1])), col)
 
-# bug - doesn't work with width=1 
-def circle_on(bitmap, cx, cy, r, col="", width=2):	# Bresenham's
+def plot_function(bitmap, f, x0, x1, transform=None, col="", width=1, n=None, batch=False):	# y = f(x) on x0..x1 as a polyline
+	# transform(x, y) gives the pixel of a point, n is the number of segments, a column each by default;
+	# with batch=True f gets the list of all the xs and returns their ys
+	if transform is None:
+		transform = lambda x, y: (x, y)
+	if n is None:
+		n = max(int(round(abs(transform(x1, 0)[0] - transform(x0, 0)[0]))), 1)
+	xs = [x0 + (x1 - x0) * k / n for k in range(n + 1)]
+	ys = f(xs) if batch else [f(x) for x in xs]
+	points = []
+	for (x, y) in zip(xs, ys):
+		if math.isfinite(y):
+			(px, py) = transform(x, y)
+			points.append((round(px, 9), round(py, 9)))	# so 2.9999999999999716 is still column 3
+		else:
+			points.append(None)
+	polyline_on(bitmap, points, col, width)
+
+def _annulus_spans(cx, cy, outer, inner, H):	# pixels with inner <= (2*distance)^2 < outer, at most two spans a row
+	if outer <= 0:
+		return
+	R = math.isqrt(outer - 1) // 2
+	for y in range(max(cy - R, 0), min(cy + R + 1, H)):
+		dy4 = 4*(y - cy)*(y - cy)
+		xo = math.isqrt(outer - dy4 - 1) // 2
+		if inner - dy4 > 0:
+			xi = math.isqrt(inner - dy4 - 1) // 2
+			yield y, cx - xo, cx - xi
+			yield y, cx + xi + 1, cx + xo + 1
+		else:
+			yield y, cx - xo, cx + xo + 1
+
+def circle_on(bitmap, cx, cy, r, col="", width=2):	# a ring from r - width/2 to r + width/2
+	if _stats is not None:
+		return _stats.draw(circle_on, (bitmap, cx, cy, r, col, width))
 	cx = int(cx)
 	cy = int(cy)
 	r = int(r)
 	width = int(width)
-	def circle_points_on(bitmap, x, y, cx, cy, col):
-		pixel_on(bitmap, cx + x, cy + y, col)
-		pixel_on(bitmap, cx - x, cy - y, col)  
-		pixel_on(bitmap, cx + x, cy - y, col)
-		pixel_on(bitmap, cx - x, cy + y, col)
-		if x != y:
-			pixel_on(bitmap, cx + y, cy + x, col)
-			pixel_on(bitmap, cx - y, cy - x, col)
-			pixel_on(bitmap, cx + y, cy - x, col)
-			pixel_on(bitmap, cx - y, cy + x, col) 
+	inner = 2*r - width
+	_annulus_on(bitmap, cx, cy, (2*r + width)**2, inner*inner if inner > 0 else 0, col)
 
-	x = 0
-	yin = r - int(width/2)
-	yout = r + int(width/2)
-
-	din = 1 - r - int(width/2) 
-	deltaEin = 3
-	deltaSEin = -2*(r - int(width/2)) + 5 
-	dout = 1 - r + int(width/2) 
-	deltaEout = 3 
-	deltaSEout = -2*(r + int(width/2)) + 5 
-
-	for y in range(yin, yout):
-		circle_points_on(bitmap, x, y, cx, cy, col)
-
-	while yout > x:
-		if din < 0:
-			din = din + deltaEin
-			deltaEin = deltaEin + 2
-			deltaSEin = deltaSEin + 2
-		else:
-			din = din + deltaSEin
-			deltaEin = deltaEin + 2
-			deltaSEin = deltaSEin + 4
-			yin = yin - 1
-		if dout < 0:
-			dout = dout + deltaEout
-			deltaEout = deltaEout + 2
-			deltaSEout = deltaSEout + 2
+def disc_on(bitmap, cx, cy, r, col=""):
+	if _stats is not None:
+		return _stats.draw(disc_on, (bitmap, cx, cy, r, col))
+	cx = int(cx)
+	cy = int(cy)
+	r = int(r)
+	_annulus_on(bitmap, cx, cy, (2*r + 1)**2, 0, col)
+
+def _annulus_on(bitmap, cx, cy, outer, inner, col):
+	if _tally is not None and outer > 0:	# the whole ring, centered where nothing clips it
+		R = math.isqrt(outer - 1) // 2
+		_tally.clipped += sum(s[2] - s[1] for s in _annulus_spans(R, R, outer, inner, 2*R + 1))
+	if isinstance(bitmap, Bitmap) and _is_ndarray(bitmap.data) and outer > 0:	# one mask over the bounding box
+		R = math.isqrt(outer - 1) // 2
+		y1 = max(cy - R, 0)
+		y2 = min(cy + R + 1, bitmap.h)
+		x1 = max(cx - R, 0)
+		x2 = min(cx + R + 1, bitmap.w)
+		if x1 < x2 and y1 < y2:
+			yy, xx = _numpy.ogrid[y1 - cy:y2 - cy, x1 - cx:x2 - cx]
+			d = 4 * (xx*xx + yy*yy)
+			box = _grid(bitmap)[y1:y2, x1:x2]
+			mask = (d < outer) & (d >= inner)
+			box[mask] = bitmap.color_index(col)
+			if _tally is not None:
+				_tally.pixels += int(mask.sum())
+		return
+	_spans_on(bitmap, _annulus_spans(cx, cy, outer, inner, _size(bitmap)[1]), col)
+
+def field_on(bitmap, field, colormap, region=None, batch=False):	# each pixel of region colored by colormap(its value)
+	# field is f(x, y) of pixel coordinates or a grid of values, region (x, y, w, h) defaults to the grid or the bitmap;
+	# with batch=True f(xs, y) gets the xs of a whole row and returns their values
+	if _stats is not None:
+		return _stats.draw(field_on, (bitmap, field, colormap, region, batch))
+	W, H = _size(bitmap)
+	grid = not callable(field)
+	if region is None:
+		region = (0, 0, len(field[0]) if len(field) else 0, len(field)) if grid else (0, 0, W, H)
+	x, y, w, h = [int(v) for v in region]
+	x1 = max(x, 0)
+	x2 = min(x + w, W)
+	y1 = max(y, 0)
+	y2 = min(y + h, H)
+	if grid:	# a region past the grid only gets the grid's part
+		x2 = min(x2, x + min([len(r) for r in field] or [0]))
+		y2 = min(y2, y + len(field))
+	if _tally is not None:
+		_tally.clipped += max(w, 0) * max(h, 0)
+	if x1 >= x2 or y1 >= y2:
+		return
+	many = colormap.many if hasattr(colormap, "many") else lambda vs: [colormap(v) for v in vs]
+	xs = list(range(x1, x2))
+	direct = isinstance(bitmap, Bitmap)	# whole rows of indices straight into the data
+	spans = {}	# color -> its runs, for bitmaps that take spans
+	for py in range(y1, y2):
+		if grid:
+			values = field[py - y][x1 - x:x2 - x]
+		elif batch:
+			values = field(xs, py)
 		else:
-			dout = dout + deltaSEout
-			deltaEout = deltaEout + 2
-			deltaSEout = deltaSEout + 4
-			yout = yout - 1
-		x = x + 1
-		for y in range(yin,yout):
-			circle_points_on(bitmap, x, y, cx, cy, col)
-
-
-def to_html(bitmap):
-	opt_bitmap = [[(c, 1, 1) for c in cline] for cline in bitmap]
-	W = len(opt_bitmap[0])
-	H = len(opt_bitmap)
-	for i in range( H ):
-		for j in range( W ):
-			(c, w, h) = opt_bitmap[i][j]
-			if w < 0 or h < 0:
-				continue
-			dj = W - j
-			for jj in range(j+1, W):
-				(cj, wj, hj) = opt_bitmap[i][jj]
-				if wj < 0 or hj < 0 or cj != c:
-					dj = jj - j
-					break
+			values = [field(px, py) for px in xs]
+		cols = many(values)
+		if direct:
+			index = bitmap.index
+			color_index = bitmap.color_index
+			row = [index.get(c) or color_index(c) for c in cols]
+			base = (bitmap.y0 + py)*bitmap.stride + bitmap.x0
+			bitmap.data[base + x1:base + x2] = row if _is_ndarray(bitmap.data) else array('H', row)
+			continue
+		px = x1
+		for (c, run) in groupby(cols):
+			n = len(list(run))
+			spans.setdefault(c, []).append((py, px, px + n))
+			px += n
+	if direct and _tally is not None:
+		_tally.pixels += (x2 - x1) * (y2 - y1)
+	for (c, runs) in spans.items():
+		_spans_on(bitmap, runs, c)
 
-			di = H - i
-			for ii in range(i+1, H):
-				for jj in range(j, j + dj):
-					(cij, wij, hij) = opt_bitmap[ii][jj]
-					if wij < 0 or hij < 0 or cij != c:
-						di = ii - i
-						break
-				if di != H - i:
-					break
+def blit(dst, src, x, y, transparent=""):	# copies src onto dst at (x, y), except its pixels of the transparent color
+	if _stats is not None:
+		return _stats.draw(blit, (dst, src, x, y, transparent))
+	if not isinstance(src, Bitmap):
+		src = _as_bitmap(src)
+	x = int(x)
+	y = int(y)
+	W, H = _size(dst)
+	x1 = max(x, 0)
+	x2 = min(x + src.w, W)
+	y1 = max(y, 0)
+	y2 = min(y + src.h, H)
+	skip = src.index.get(transparent, -1) if transparent is not None else -1	# no index is -1
+	if _tally is not None:	# the pixels that are not transparent, wherever they are
+		_tally.clipped += sum(len(r) - r.count(transparent) for r in src.to_rows())
+	if x1 >= x2 or y1 >= y2:
+		return
+	data = src.data
+	n = x2 - x1
+	starts = [(src.y0 + py - y)*src.stride + src.x0 + x1 - x for py in range(y1, y2)]
+	if not isinstance(dst, Bitmap):	# a list or a Canvas gets the runs as spans, a list of them per color
+		spans = {}
+		for (py, s) in zip(range(y1, y2), starts):
+			k = x1
+			for (i, run) in groupby(data[s:s + n]):
+				m = len(list(run))
+				if i != skip:
+					spans.setdefault(src.palette[i], []).append((py, k, k + m))
+				k += m
+		for (c, runs) in spans.items():
+			_spans_on(dst, runs, c)
+		return
+	to_numpy = _is_ndarray(dst.data)
+	tr = None	# src index -> dst index, None if they agree
+	if dst.palette is not src.palette and dst.palette[:len(src.palette)] != src.palette:
+		tr = [dst.color_index(c) for c in src.palette]
+		if to_numpy or _is_ndarray(data):
+			tr = _numpy.array(tr, dtype=_numpy.uint16)
+	rows = list(zip(range(y1, y2), starts))
+	if data is dst.data and dst.y0 + y > src.y0:	# moving down within the same pixels, go from the bottom
+		rows.reverse()
+	written = 0
+	for (py, s) in rows:
+		d = (dst.y0 + py)*dst.stride + dst.x0 + x1
+		src_row = data[s:s + n]
+		row = src_row
+		if tr is not None:
+			row = tr[row] if _is_ndarray(tr) else array('H', [tr[i] for i in row])
+		if to_numpy != _is_ndarray(row):
+			row = _numpy.array(row, dtype=_numpy.uint16) if to_numpy else array('H', row.tolist())
+		elif type(row) is memoryview:	# from a MappedBitmap
+			row = array('H', row)
+		elif to_numpy and tr is None:
+			row = row.copy()	# not a view of pixels the write may overlap
+		if skip < 0 or skip not in src_row:
+			dst.data[d:d + n] = row
+			written += n
+			continue
+		k = 0
+		for (i, run) in groupby(src_row.tolist()):	# only the runs of the other colors
+			m = len(list(run))
+			if i != skip:
+				dst.data[d + k:d + k + m] = row[k:k + m]
+				written += m
+			k += m
+	if _tally is not None:
+		_tally.pixels += written
 
-			if di != 1 or dj != 1:
-				for ii in range(i, i+di):
-					for jj in range(j, j+dj):
-						opt_bitmap[ii][jj] = (c, -1, -1)
-			opt_bitmap[i][j] = (c, dj, di)
 
+class Canvas(object):	# records primitives and draws them all at once, topmost first
+	__slots__ = ('w', 'h', 'col', 'z', 'items')
 
-	ret = "<table border=0 cellspacing=0 cellpadding=0 width=" + str(W) + ">\n"
-	ret += "<tr height=0>"
-	for c in bitmap[0]:
-		ret += "<td width=1></td>"
-	ret += "</tr>\n"
+	def __init__(self, w, h, col=""):
+		self.w = w
+		self.h = h
+		self.col = col
+		self.z = 0	# layer for the primitives recorded next, higher is on top
+		self.items = []	# (z, seq, top, bottom, ys, spans, col)
 
-	for cline in opt_bitmap:
-		ret += "<tr height=1>"
-		for (c, w, h) in cline:
-			if c == "":
-				bg = ""
-			else:
-				bg = " bgcolor=" + c
+	def add(self, spans, col):
+		w = self.w
+		h = self.h
+		clipped = []
+		for (y, x1, x2) in spans:
+			if 0 <= y < h:
+				if x1 < 0:
+					x1 = 0
+				if x2 > w:
+					x2 = w
+				if x1 < x2:
+					clipped.append((y, x1, x2))
+		if clipped:
+			clipped.sort()
+			ys = [s[0] for s in clipped]
+			self.items.append((self.z, len(self.items), ys[0], ys[-1] + 1, ys, clipped, col))
+
+	def bands(self):	# yields (y1, y2, items on those rows, topmost first)
+		items = sorted(self.items, key=lambda it: it[2])
+		active = []
+		k = 0
+		for b0 in range(0, self.h, BAND):
+			b1 = min(b0 + BAND, self.h)
+			while k < len(items) and items[k][2] < b1:
+				active.append(items[k])
+				k += 1
+			active = [it for it in active if it[3] > b0]
+			active.sort(reverse=True)
+			yield b0, b1, active
+
+	def paint(self, target, b0, b1, items, dy=0):	# draws rows b0..b1 into target's rows b0-dy..b1-dy
+		data = target.data
+		w = self.w
+		rows = [[] for y in range(b0, b1)]	# spans of every row, topmost first
+		for it in items:
+			fill = array('H', [target.color_index(it[6])])
+			ys = it[4]
+			spans = it[5]
+			for k in range(bisect_left(ys, b0), bisect_left(ys, b1)):
+				(y, x1, x2) = spans[k]
+				rows[y - b0].append((x1, x2, fill))
+		for y in range(b0, b1):
+			base = (y - dy) * w
+			edges = []	# painted parts of the row, [x1, x2, x1, x2...]
+			for (x1, x2, fill) in rows[y - b0]:
+				i = bisect_right(edges, x1)
+				if i == bisect_left(edges, x2, i):	# nothing painted inside, the usual case
+					if i % 2:
+						continue
+					edges[i:i] = (x1, x2)
+					data[base + x1:base + x2] = fill * (x2 - x1)
+				else:
+					for (g1, g2) in _cover(edges, x1, x2):
+						data[base + g1:base + g2] = fill * (g2 - g1)
+				if len(edges) == 2 and edges[0] == 0 and edges[1] == w:
+					break
 
-			if w < 0 or h < 0:
+	def render(self):
+		bitmap = Bitmap(self.w, self.h, self.col)
+		for (b0, b1, items) in self.bands():
+			self.paint(bitmap, b0, b1, items)
+		return bitmap
+
+	def row_runs(self):	# the rows of render() without rendering it, empty bands come for free
+		bg = ([0], [self.w], [self.col])
+		for (b0, b1, items) in self.bands():
+			if not items:
+				for y in range(b0, b1):
+					yield bg
 				continue
-			elif w > 1 and h > 1:
-				ret += "<td" + bg + " colspan=" + str(w) + " rowspan=" + str(h) + "></td>"
-			elif w > 1:
-				ret += "<td" + bg + " colspan=" + str(w) + "></td>"
-			elif h > 1:
-				ret += "<td" + bg + " rowspan=" + str(h) + "></td>"
+			band = Bitmap(self.w, b1 - b0, self.col)
+			self.paint(band, b0, b1, items, b0)
+			for runs in _row_runs(band):
+				yield runs
+
+def _cover(edges, x1, x2):	# marks [x1, x2) painted, returns its parts that were not
+	i = bisect_right(edges, x1)
+	j = bisect_left(edges, x2, i)
+	points = ([x1] if i % 2 == 0 else []) + edges[i:j] + ([x2] if j % 2 == 0 else [])
+	edges[i:j] = ([x1] if i % 2 == 0 else []) + ([x2] if j % 2 == 0 else [])
+	return [(points[k], points[k + 1]) for k in range(0, len(points), 2) if points[k] < points[k + 1]]
+
+
+def _row_runs(bitmap, y1=0, y2=None):	# yields (starts, ends, colors) of the same-color runs of rows y1..y2
+	if type(bitmap) is Canvas:
+		for runs in bitmap.row_runs():
+			yield runs
+		return
+	if type(bitmap) is list:
+		for cline in bitmap:
+			starts, ends, cols = [], [], []
+			x = 0
+			for c, g in groupby(cline):
+				starts.append(x)
+				x += len(list(g))
+				ends.append(x)
+				cols.append(c)
+			yield starts, ends, cols
+		return
+	data = bitmap.data
+	palette = bitmap.palette
+	w = bitmap.w
+	stride = bitmap.stride
+	x0 = bitmap.x0 + bitmap.y0*stride
+	if _is_ndarray(data) and w:	# run starts are where a pixel differs from its left neighbour
+		for y in range(y1, bitmap.h if y2 is None else y2):
+			r = data[x0 + y*stride:x0 + y*stride + w]
+			cut = (_numpy.flatnonzero(r[1:] != r[:-1]) + 1).tolist()
+			starts = [0] + cut
+			yield starts, cut + [w], [palette[i] for i in r[starts].tolist()]
+		return
+	for y in range(y1, bitmap.h if y2 is None else y2):
+		starts, ends, cols = [], [], []
+		x = 0
+		for i, g in groupby(data[x0 + y*stride:x0 + y*stride + w]):
+			starts.append(x)
+			x += len(list(g))
+			ends.append(x)
+			cols.append(palette[i])
+		yield starts, ends, cols
+
+
+# Merging turns rows of runs into rows of cells. Every cell is (x, w, h, col)
+# and is yielded with the row it starts on, as soon as its height is known.
+
+def _merge_minimal(runs):	# greedy: widest free run to the right, then as far down as it repeats
+	runs = iter(runs)
+	ahead = []	# rows read so far but not yet yielded, ahead[0] is the current one
+	claims = []	# (x1, x2, end_row) of cells spanning down from rows above
+	i = 0
+	for row in runs:
+		ahead.append(row)
+		while ahead:
+			starts, ends, cols = ahead[0]
+			claims = [cl for cl in claims if cl[2] > i]
+			cells = []
+			new_claims = []
+			for gx1, gx2 in _gaps(claims, ends[-1] if ends else 0):
+				k = bisect_right(starts, gx1) - 1
+				x = gx1
+				while x < gx2:
+					x2 = ends[k] if ends[k] < gx2 else gx2
+					c = cols[k]
+					di = 1
+					while True:
+						if di == len(ahead):
+							nxt = next(runs, None)
+							if nxt is None:
+								break
+							ahead.append(nxt)
+						s2, e2, c2 = ahead[di]
+						k2 = bisect_right(s2, x) - 1
+						if c2[k2] != c or e2[k2] < x2:
+							break
+						di += 1
+					cells.append((x, x2 - x, di, c))
+					if di > 1:
+						new_claims.append((x, x2, i + di))
+					x = x2
+					k += 1
+			if new_claims:
+				claims = sorted(claims + new_claims)
+			del ahead[0]
+			i += 1
+			yield cells
+
+def _gaps(claims, W):	# free intervals of a row between the claimed ones
+	x = 0
+	for (x1, x2, _) in claims:
+		if x1 > x:
+			yield x, x1
+		x = x2
+	if W > x:
+		yield x, W
+
+def _merge_fast(runs):	# a run equal to the run right above it extends that cell down
+	pending = []	# rows of cells waiting for their heights
+	first = 0	# index of pending[0]
+	growing = {}	# (x1, x2, col) -> (cell, start row) for cells touching the last row
+	i = -1
+	for i, (starts, ends, cols) in enumerate(runs):
+		still = {}
+		cells = []
+		for key in zip(starts, ends, cols):
+			entry = growing.get(key)
+			if entry is None:
+				entry = ([key[0], key[1] - key[0], 1, key[2]], i)
+				cells.append(entry[0])
 			else:
-				ret += "<td" + bg + "></td>"
-		ret += "</tr>\n"
+				entry[0][2] += 1
+			still[key] = entry
+		growing = still
+		pending.append(cells)
+		done = min(e[1] for e in growing.values()) if growing else i + 1
+		if done > first:
+			for cells in pending[:done - first]:
+				yield cells
+			del pending[:done - first]
+			first = done
+	for cells in pending:
+		yield cells
 
+_MERGES = {"minimal": _merge_minimal, "fast": _merge_fast}
 
-	ret += "</table>"
-	
-	return ret
+
+def _differing(a, b, lo, hi, k, blocks):	# adds the blocks of k columns where rows a and b differ between lo and hi, lo a multiple of k
+	if a[lo:hi] == b[lo:hi]:	# compared in C, halving finds a few differences in a long row quickly
+		return
+	if hi - lo <= k:
+		blocks.add(lo // k)
+		return
+	mid = lo + (hi - lo + k - 1) // k // 2 * k
+	_differing(a, b, lo, mid, k, blocks)
+	_differing(a, b, mid, hi, k, blocks)
+
+def downsample(bitmap, k, mode="majority"):	# a bitmap k times smaller, a pixel per k x k block in one of the bitmap's colors
+	# mode "majority" takes the block's most common color (the earlier in the palette on a tie), "average" the color nearest to its mean
+	if mode not in ("majority", "average"):
+		raise ValueError("Unknown downsample mode: " + repr(mode))
+	k = int(k)
+	if k < 1:
+		raise ValueError("Downsample factor must be at least 1: " + repr(k))
+	if not isinstance(bitmap, Bitmap):
+		bitmap = _as_bitmap(bitmap)
+	W = bitmap.w
+	H = bitmap.h
+	w = (W + k - 1) // k
+	h = (H + k - 1) // k
+	out = Bitmap(w, h, backend="numpy" if _is_ndarray(bitmap.data) else "array")
+	out.palette = list(bitmap.palette)	# the same indices
+	out.index = dict(bitmap.index)
+	palette = bitmap.palette
+	rgbs = dict((c, _rgb(c)) for c in palette if c != "")
+	snap = {}	# mean (r, g, b) -> nearest color
+	data = bitmap.data
+	stride = bitmap.stride
+
+	def pick(block):	# the index a block of indices gets
+		i = block[0]
+		if block.count(i) == len(block):
+			return i
+		if mode == "majority":
+			return max(sorted(set(block)), key=block.count)
+		return out.index[_mean_color(dict((palette[i], block.count(i)) for i in set(block)), rgbs, snap)]
+
+	if _is_ndarray(data):	# the whole blocks at once, a block is mixed if a pixel differs from its top left one
+		if not (w and h):
+			return out
+		grid = out.data.reshape(h, w)
+		src = _grid(bitmap)
+		hf = H // k
+		wf = W // k
+		if hf and wf:
+			pixels = src[:hf*k, :wf*k]
+			corner = pixels[::k, ::k]
+			grid[:hf, :wf] = corner
+			i = _numpy.flatnonzero(pixels != _numpy.repeat(_numpy.repeat(corner, k, axis=0), k, axis=1))
+			mixed = _numpy.zeros(hf * wf, dtype=bool)
+			mixed[i // (wf*k*k) * wf + i % (wf*k) // k] = True	# few pixels differ in a smooth picture
+			mixed = _numpy.flatnonzero(mixed)
+			ys = mixed // wf
+			xs = mixed % wf
+			blocks = pixels.reshape(hf, k, wf, k)[ys, :, xs, :].reshape(-1, k*k)
+			for (y, x, block) in zip(ys.tolist(), xs.tolist(), blocks.tolist()):
+				grid[y, x] = pick(block)
+		for by in range(h):	# the blocks cut short by the right and bottom edges
+			for bx in (range(w) if by >= hf else range(wf, w)):
+				grid[by, bx] = pick(src[by*k:by*k + k, bx*k:bx*k + k].ravel().tolist())
+		return out
+
+	for by in range(h):	# a band of k rows from its runs: a block inside a run takes the run's index
+		rows = []
+		for y in range(by*k, min(by*k + k, H)):
+			base = (bitmap.y0 + y)*stride + bitmap.x0
+			row = data[base:base + W]
+			rows.append(row if type(row) is array else array('H', row))	# a copy of a MappedBitmap's row
+		first = rows[0]
+		indices = first[::k]	# every block's top left pixel
+		step = w // 64 + 1	# a sample of the blocks is enough to tell noise
+		if 4*sum(map(ne, indices[::step], first[1::k][::step])) > w // step:	# noise, counting them all costs less than looking for the few
+			check = range(w)
+		else:
+			check = set()	# blocks with a run edge inside or rows that differ, to be counted
+			x = 0
+			for i, g in groupby(first):
+				x += len(list(g))
+				if x % k and x < W:
+					check.add(x // k)
+			for r in rows[1:]:	# the other rows only matter where they differ from the first
+				_differing(first, r, 0, W, k, check)
+		for bx in check:
+			x = bx * k
+			block = array('H')
+			for r in rows:
+				block += r[x:x + k]
+			indices[bx] = pick(block)
+		out.data[by*w:(by+1)*w] = indices
+	return out
+
+def _mean_color(block, rgbs, snap):	# the color nearest to the mean of the block's colors, "" if it is mostly ""
+	n = sum(block.values())
+	clear = block.get("", 0)
+	if 2*clear > n:
+		return ""
+	n -= clear
+	r = g = b = 0
+	for (c, m) in block.items():
+		if c != "":
+			rgb = rgbs[c]
+			r += rgb[0] * m
+			g += rgb[1] * m
+			b += rgb[2] * m
+	mean = ((2*r + n) // (2*n), (2*g + n) // (2*n), (2*b + n) // (2*n))
+	c = snap.get(mean)
+	if c is None:
+		c = min(rgbs, key=lambda c: (rgbs[c][0] - mean[0])**2 + (rgbs[c][1] - mean[1])**2 + (rgbs[c][2] - mean[2])**2)
+		snap[mean] = c
+	return c
+
+
+class _Attrs(dict):	# color -> the attribute a <td> of that color gets, made on first use
+	def __init__(self, css=False):
+		dict.__init__(self)
+		self.css = css
+
+	def __missing__(self, c):
+		if c == "":
+			a = ""
+		elif self.css:
+			a = " class=" + _css_class(c)
+		else:
+			a = " bgcolor=" + c
+		self[c] = a
+		return a
+
+def _tr(cells, attrs, tr="<tr height=1>"):
+	tr = [tr]
+	for (x, w, h, c) in cells:
+		bg = attrs[c]
+		if w > 1 and h > 1:
+			tr.append("<td" + bg + " colspan=" + str(w) + " rowspan=" + str(h) + "></td>")
+		elif w > 1:
+			tr.append("<td" + bg + " colspan=" + str(w) + "></td>")
+		elif h > 1:
+			tr.append("<td" + bg + " rowspan=" + str(h) + "></td>")
+		else:
+			tr.append("<td" + bg + "></td>")
+	tr.append("</tr>\n")
+	return "".join(tr)
+
+def _css_class(col):	# named after the color, so tables on one page never disagree
+	name = col[1:]
+	if col[:1] == "#" and name.isalnum() and name.isascii():	# "#F00" is cF00, "F00" is another color
+		return "c" + name
+	return "c_" + col.encode("utf-8").hex()
+
+def _css_color(col):	# what a browser makes of bgcolor=col, as CSS
+	s = col[1:] if col[:1] == "#" else col
+	if s != col and len(s) in (3, 6) and all(ch in _HEX for ch in s):
+		return col
+	if s == col and s.lower() in _NAMED:	# a CSS color name, other words are read as hex
+		return col
+	return "#%02x%02x%02x" % _rgb(col)
+
+_HEX = "0123456789abcdefABCDEF"
+_NAMED = """aliceblue f0f8ff antiquewhite faebd7 aqua 00ffff aquamarine 7fffd4 azure f0ffff beige f5f5dc bisque ffe4c4 black 000000
+blanchedalmond ffebcd blue 0000ff blueviolet 8a2be2 brown a52a2a burlywood deb887 cadetblue 5f9ea0 chartreuse 7fff00 chocolate d2691e
+coral ff7f50 cornflowerblue 6495ed cornsilk fff8dc crimson dc143c cyan 00ffff darkblue 00008b darkcyan 008b8b darkgoldenrod b8860b
+darkgray a9a9a9 darkgreen 006400 darkgrey a9a9a9 darkkhaki bdb76b darkmagenta 8b008b darkolivegreen 556b2f darkorange ff8c00
+darkorchid 9932cc darkred 8b0000 darksalmon e9967a darkseagreen 8fbc8f darkslateblue 483d8b darkslategray 2f4f4f darkslategrey 2f4f4f
+darkturquoise 00ced1 darkviolet 9400d3 deeppink ff1493 deepskyblue 00bfff dimgray 696969 dimgrey 696969 dodgerblue 1e90ff
+firebrick b22222 floralwhite fffaf0 forestgreen 228b22 fuchsia ff00ff gainsboro dcdcdc ghostwhite f8f8ff gold ffd700 goldenrod daa520
+gray 808080 green 008000 greenyellow adff2f grey 808080 honeydew f0fff0 hotpink ff69b4 indianred cd5c5c indigo 4b0082 ivory fffff0
+khaki f0e68c lavender e6e6fa lavenderblush fff0f5 lawngreen 7cfc00 lemonchiffon fffacd lightblue add8e6 lightcoral f08080
+lightcyan e0ffff lightgoldenrodyellow fafad2 lightgray d3d3d3 lightgreen 90ee90 lightgrey d3d3d3 lightpink ffb6c1 lightsalmon ffa07a
+lightseagreen 20b2aa lightskyblue 87cefa lightslategray 778899 lightslategrey 778899 lightsteelblue b0c4de lightyellow ffffe0
+lime 00ff00 limegreen 32cd32 linen faf0e6 magenta ff00ff maroon 800000 mediumaquamarine 66cdaa mediumblue 0000cd mediumorchid ba55d3
+mediumpurple 9370db mediumseagreen 3cb371 mediumslateblue 7b68ee mediumspringgreen 00fa9a mediumturquoise 48d1cc
+mediumvioletred c71585 midnightblue 191970 mintcream f5fffa mistyrose ffe4e1 moccasin ffe4b5 navajowhite ffdead navy 000080
+oldlace fdf5e6 olive 808000 olivedrab 6b8e23 orange ffa500 orangered ff4500 orchid da70d6 palegoldenrod eee8aa palegreen 98fb98
+paleturquoise afeeee palevioletred db7093 papayawhip ffefd5 peachpuff ffdab9 peru cd853f pink ffc0cb plum dda0dd powderblue b0e0e6
+purple 800080 rebeccapurple 663399 red ff0000 rosybrown bc8f8f royalblue 4169e1 saddlebrown 8b4513 salmon fa8072 sandybrown f4a460
+seagreen 2e8b57 seashell fff5ee sienna a0522d silver c0c0c0 skyblue 87ceeb slateblue 6a5acd slategray 708090 slategrey 708090
+snow fffafa springgreen 00ff7f steelblue 4682b4 tan d2b48c teal 008080 thistle d8bfd8 tomato ff6347 turquoise 40e0d0 violet ee82ee
+wheat f5deb3 white ffffff whitesmoke f5f5f5 yellow ffff00 yellowgreen 9acd32""".split()	# the CSS named colors, name and hex
+_NAMED = dict((name, tuple(int(h[k:k+2], 16) for k in (0, 2, 4))) for (name, h) in zip(_NAMED[::2], _NAMED[1::2]))
+
+def _rgb(col):	# what a browser makes of bgcolor=col, as (r, g, b)
+	s = col[1:] if col[:1] == "#" else col
+	if s == col and s.lower() in _NAMED:
+		return _NAMED[s.lower()]
+	if s != col and len(s) == 3 and all(ch in _HEX for ch in s):
+		return tuple(int(ch, 16) * 17 for ch in s)
+	# the HTML legacy color rules: pad to thirds, keep at most two significant digits of each
+	s = "".join(ch if ch in _HEX else "0" for ch in s) or "0"
+	s += "0" * (-len(s) % 3)
+	n = len(s) // 3
+	parts = [s[k*n:(k+1)*n][-8:] for k in range(3)]
+	while len(parts[0]) > 2 and all(p[0] == "0" for p in parts):
+		parts = [p[1:] for p in parts]
+	return tuple(int(p[:2], 16) for p in parts)
+
+def _colors(bitmap):	# every color the bitmap may have, background first
+	if type(bitmap) is list:
+		return list(dict.fromkeys(c for cline in bitmap for c in cline))
+	if type(bitmap) is Canvas:
+		return list(dict.fromkeys([bitmap.col] + [it[6] for it in bitmap.items]))
+	return bitmap.palette
+
+def _html_head(bitmap, style):	# (what goes before the rows, td attributes, row start)
+	W = _size(bitmap)[0]
+	if style == "css":	# a class per color and a <colgroup> instead of bgcolor= and the width row
+		return "<style>\n" \
+			"table.hb{border-collapse:collapse;table-layout:fixed}\n" \
+			"table.hb tr{height:1px}\n" \
+			"table.hb td{padding:0}\n" + \
+			"".join("." + _css_class(c) + "{background:" + _css_color(c) + "}\n" for c in _colors(bitmap) if c != "") + \
+			"</style>\n" \
+			"<table class=hb border=0 cellspacing=0 cellpadding=0 width=" + str(W) + ">\n" \
+			"<colgroup><col span=" + str(W) + " width=1></colgroup>\n", _Attrs(True), "<tr>"
+	return "<table border=0 cellspacing=0 cellpadding=0 width=" + str(W) + ">\n" \
+		"<tr height=0>" + "<td width=1></td>" * W + "</tr>\n", _Attrs(), "<tr height=1>"
+
+def iter_html(bitmap, merge="minimal", style="attr"):	# yields the table piece by piece, one <tr> at a time
+	if merge not in _MERGES:
+		raise ValueError("Unknown merge strategy: " + repr(merge))
+	if style not in ("attr", "css"):
+		raise ValueError("Unknown table style: " + repr(style))
+	head, attrs, tr = _html_head(bitmap, style)
+	yield head
+
+	if _stats is not None:
+		for chunk in _stats.html(head, _MERGES[merge](_row_runs(bitmap)), attrs, tr):
+			yield chunk
+		return
+	for cells in _MERGES[merge](_row_runs(bitmap)):	# a row spanned from above has no cells
+		yield _tr(cells, attrs, tr)
+
+	yield "</table>"
+
+def write_html(bitmap, fp, merge="minimal", style="attr"):	# fp is anything with write(str)
+	for chunk in iter_html(bitmap, merge, style):
+		fp.write(chunk)
+
+def to_html(bitmap, merge="minimal", style="attr", format="table", scale=1):	# style="css" for a smaller table, format="img" for a PNG
+	t = perf_counter()
+	if scale != 1:	# a pixel for each scale x scale block
+		bitmap = downsample(bitmap, scale)
+		if _stats is not None:
+			_stats.time["merge"] += perf_counter() - t
+	if format == "img":	# no cells to count, only the bytes and the time
+		t = perf_counter()
+		w, h = _size(bitmap)
+		html = "<img width=" + str(w) + " height=" + str(h) + " src=\"data:image/png;base64," + \
+			base64.b64encode(to_png_bytes(bitmap)).decode("ascii") + "\">"
+		if _stats is not None:
+			_stats.time["html"] += perf_counter() - t
+			_stats.bytes += len(html)
+		return html
+	if format != "table":
+		raise ValueError("Unknown html format: " + repr(format))
+	return "".join(iter_html(bitmap, merge, style))
+
+
+def _as_bitmap(bitmap):	# a Bitmap with its rows one after another in data
+	if type(bitmap) is list:
+		return Bitmap.from_rows(bitmap)
+	if type(bitmap) is Canvas:
+		return bitmap.render()
+	if _is_view(bitmap):
+		copy = Bitmap(bitmap.w, bitmap.h, backend="numpy" if _is_ndarray(bitmap.data) else "array")
+		copy.palette = list(bitmap.palette)
+		copy.index = dict(bitmap.index)
+		blit(copy, bitmap, 0, 0, None)
+		return copy
+	return bitmap
+
+def _png_chunk(kind, data):
+	return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+def _bytes_sub(a, b, n):	# (a - b) mod 256 for each byte, a and b are n-byte big-endian ints
+	top = int.from_bytes(b'\x80' * n, "big")
+	mask = (1 << (8*n)) - 1
+	return ((((a | top) - (b & ~top & mask)) ^ ((a ^ ~b) & top)) & mask).to_bytes(n, "big")
+
+def iter_png(bitmap, level=6):	# yields a PNG piece by piece, IDAT chunks as the compressor fills them
+	bitmap = _as_bitmap(bitmap)
+	w = bitmap.w
+	h = bitmap.h
+	palette = bitmap.palette
+	colors = [_rgb(c) if c != "" else (0, 0, 0) for c in palette]
+	if len(palette) <= 256:	# 8-bit palette, "" is transparent
+		bpp = 1
+		yield b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', struct.pack(">IIBBBBB", w, h, 8, 3, 0, 0, 0))
+		yield _png_chunk(b'PLTE', b"".join(struct.pack("BBB", *c) for c in colors))
+		yield _png_chunk(b'tRNS', bytes(0 if c == "" else 255 for c in palette))
+		def row_bytes(y):
+			return array('B', bitmap.data[y*w:(y+1)*w]).tobytes()
+	else:	# RGBA
+		bpp = 4
+		yield b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', struct.pack(">IIBBBBB", w, h, 8, 6, 0, 0, 0))
+		rgba = [struct.pack("BBBB", r, g, b, 0 if c == "" else 255) for ((r, g, b), c) in zip(colors, palette)]
+		def row_bytes(y):
+			return b"".join([rgba[i] for i in bitmap.data[y*w:(y+1)*w]])
+
+	z = zlib.compressobj(level)
+	n = w * bpp
+	prev = 0
+	for y in range(h):
+		raw = row_bytes(y)
+		cur = int.from_bytes(raw, "big")
+		# per row, the filter with the most zero bytes of None, Sub and Up
+		best = b'\x00' + raw
+		zeros = raw.count(0)
+		for (kind, other) in ((b'\x01', cur >> (8*bpp)), (b'\x02', prev)):
+			line = _bytes_sub(cur, other, n) if n else b""
+			if line.count(0) > zeros:
+				best = kind + line
+				zeros = line.count(0)
+		prev = cur
+		out = z.compress(best)
+		if out:
+			yield _png_chunk(b'IDAT', out)
+	yield _png_chunk(b'IDAT', z.flush()) + _png_chunk(b'IEND', b"")
+
+def to_png_bytes(bitmap, level=6):
+	return b"".join(iter_png(bitmap, level))
+
+def write_png(bitmap, fp, level=6):	# fp is anything with write(bytes)
+	for chunk in iter_png(bitmap, level):
+		fp.write(chunk)
+
+def to_svg(bitmap, merge="fast"):	# the merged cells as rectangles, a group per color
+	if merge not in _MERGES:
+		raise ValueError("Unknown merge strategy: " + repr(merge))
+	w, h = _size(bitmap)
+	groups = {}
+	for (y, cells) in enumerate(_MERGES[merge](_row_runs(bitmap))):
+		for (x, cw, ch, c) in cells:
+			if c != "":
+				groups.setdefault(c, []).append('<rect x="%d" y="%d" width="%d" height="%d"/>' % (x, y, cw, ch))
+	return '<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" shape-rendering="crispEdges">\n' % (w, h) + \
+		"".join('<g fill="' + _css_color(c) + '">' + "".join(rects) + "</g>\n" for (c, rects) in groups.items()) + \
+		"</svg>"
+
+
+# Bands of rows merged with merge_fast on their own are stitched back into
+# exactly the merge of the whole: a cell on the top row of a band continues
+# the one above the seam if they repeat the same run.
+
+def _band(rows):	# (rows of cells, cells on the top row, cells reaching the bottom row)
+	# a row may also be its finished <tr> already, if it has no cells of the other two kinds
+	bottoms = [c for (i, cells) in enumerate(rows) if type(cells) is not str for c in cells if i + c[2] == len(rows)]
+	return (rows, rows[0] if rows else [], bottoms)
+
+def _stitch(bands):	# (id(cell) -> rows it gains below its band, ids of the cells continuing one from above)
+	extra = {}
+	skip = set()
+	growing = {}
+	for (rows, tops, bottoms) in bands:
+		for c in tops:
+			owner = growing.get((c[0], c[1], c[3]))
+			if owner is not None:
+				skip.add(id(c))
+				extra[id(owner)] = extra.get(id(owner), 0) + c[2]
+		still = {}
+		for c in bottoms:
+			key = (c[0], c[1], c[3])
+			still[key] = growing.get(key, c) if id(c) in skip else c
+		growing = still
+	return extra, skip
+
+def _band_rows(band, extra, skip, attrs, tr):	# the <tr>s of a stitched band
+	for cells in band[0]:
+		if type(cells) is str:
+			yield cells
+			continue
+		yield _tr([(c[0], c[1], c[2] + extra.get(id(c), 0), c[3]) for c in cells if id(c) not in skip], attrs, tr)
+
+class HtmlRenderer(object):	# to_html(bitmap, merge="fast") that redoes only the bands changed since the last call
+	__slots__ = ('bitmap', 'bands', 'frags', 'pixels')
+
+	def __init__(self, bitmap):
+		if not isinstance(bitmap, Bitmap):	# a converted copy would not see later drawing
+			raise TypeError("HtmlRenderer needs a Bitmap, not " + type(bitmap).__name__)
+		if _is_view(bitmap):
+			raise ValueError("HtmlRenderer needs a whole bitmap, not a view")
+		self.bitmap = bitmap
+		n = (bitmap.h + BAND - 1) // BAND
+		self.bands = [None] * n	# (rows of cells, cells on the top row, cells reaching the bottom row)
+		self.frags = [None] * n	# (stitching signature, html of the band's rows)
+		self.pixels = [None] * n	# the band's indices as bytes, as they were merged: a second copy of the pixels instead of dirty flags every write would have to set
+
+	def _merge_band(self, k):
+		b = self.bitmap
+		y1 = k * BAND
+		y2 = min(y1 + BAND, b.h)
+		self.bands[k] = _band(list(_merge_fast(_row_runs(b, y1, y2))))
+		self.frags[k] = None
+
+	def iter_html(self):
+		stats = _stats
+		t = perf_counter()
+		b = self.bitmap
+		W = b.w
+		for k in range(len(self.bands)):	# comparing the indices costs far less than merging them again
+			pixels = b.data[k*BAND*W:min(k*BAND + BAND, b.h)*W].tobytes()
+			if pixels != self.pixels[k]:
+				self._merge_band(k)
+				self.pixels[k] = pixels
+
+		extra, skip = _stitch(self.bands)
+		head, attrs, tr = _html_head(b, "attr")
+		if stats is not None:	# the whole table, however little of it was redone
+			stats.time["merge"] += perf_counter() - t
+			stats.cells += sum(len(cells) for band in self.bands for cells in band[0]) - len(skip)
+			stats.covered += W * b.h
+			stats.bytes += len(head) + len("</table>")
+		yield head
+		for (k, band) in enumerate(self.bands):
+			t = perf_counter()
+			sig = (tuple(extra.get(id(c), 0) for c in band[2]), tuple(id(c) in skip for c in band[1]))
+			frag = self.frags[k]
+			if frag is None or frag[0] != sig:
+				frag = (sig, "".join(_band_rows(band, extra, skip, attrs, tr)))
+				self.frags[k] = frag
+			if stats is not None:
+				stats.time["html"] += perf_counter() - t
+				stats.bytes += len(frag[1])
+			yield frag[1]
+		yield "</table>"
+
+	def to_html(self):
+		return "".join(self.iter_html())
+
+
+
+def _render_tile(job):	# in a worker: merges some rows and writes every <tr> the stitching cannot change
+	w, h, raw, palette, style = job
+	tile = Bitmap(w, 0)
+	tile.data = array('H')
+	tile.data.frombytes(raw)
+	tile.h = h	# not len(data) // w, a bitmap 0 pixels wide still has rows
+	tile.palette = palette
+	rows = list(_merge_fast(_row_runs(tile)))
+	n = len(rows)
+	seams = set([0] + [n - c[2] for c in _band(rows)[2]])	# rows with cells on the top or reaching the bottom
+	attrs = _Attrs(style == "css")
+	tr = "<tr>" if style == "css" else "<tr height=1>"
+	return [cells if i in seams else _tr(cells, attrs, tr) for (i, cells) in enumerate(rows)], sum(len(cells) for cells in rows)
+
+def iter_html_parallel(bitmap, workers=None, rows=256, style="attr"):	# iter_html(bitmap, "fast", style), bands done in processes
+	if style not in ("attr", "css"):
+		raise ValueError("Unknown table style: " + repr(style))
+	if rows < 1:
+		raise ValueError("Rows in a band must be at least 1: " + repr(rows))
+	bitmap = _as_bitmap(bitmap)
+	w = bitmap.w
+	h = bitmap.h
+	data = bitmap.data
+	palette = list(bitmap.palette)
+	jobs = [(w, min(y + rows, h) - y, data[y*w:min(y + rows, h)*w].tobytes(), palette, style) for y in range(0, h, rows)]
+	stats = _stats
+	t = perf_counter()
+	if workers == 1:
+		tiles = list(map(_render_tile, jobs))
+	else:
+		from concurrent.futures import ProcessPoolExecutor	# only here, it takes a while to import
+		with ProcessPoolExecutor(workers) as pool:
+			tiles = list(pool.map(_render_tile, jobs))
+	bands = [_band(tile) for (tile, cells) in tiles]
+	extra, skip = _stitch(bands)
+	head, attrs, tr = _html_head(bitmap, style)
+	if stats is not None:	# the workers write most rows too, that time is all "merge"
+		stats.time["merge"] += perf_counter() - t
+		stats.cells += sum(cells for (tile, cells) in tiles) - len(skip)
+		stats.covered += w * h
+		stats.bytes += len(head) + len("</table>")
+	yield head
+	for band in bands:
+		t = perf_counter()
+		chunk = "".join(_band_rows(band, extra, skip, attrs, tr))
+		if stats is not None:
+			stats.time["html"] += perf_counter() - t
+			stats.bytes += len(chunk)
+		yield chunk
+	yield "</table>"
+
+def to_html_parallel(bitmap, workers=None, rows=256, style="attr"):
+	return "".join(iter_html_parallel(bitmap, workers, rows, style))
 
 
 
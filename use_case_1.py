@@ -75,10 +75,10 @@ if __name__ == "__main__":
 	from html_bitmap import *
 	bmp = new_bitmap(500, 500)
 
-	for i in range(0, 500, 1):
-		for j in range(0, 500, 1):
-			f = 16*int(math.atan(f2(j/100.0, i/100.0))/math.pi * 32)
-			pixel_on(bmp, j, i, to_hex(f, 0, 0))
+	def shade(v):
+		return to_hex(16*int(math.atan(v)/math.pi * 32), 0, 0)
+
+	field_on(bmp, lambda j, i: f2(j/100.0, i/100.0), shade)
 
 	for i in range(0, 101, 2):
 		for j in range(0, 101, 2):
@@ -9,6 +9,12 @@ continuousness of up to basis functions order.
 akalenuk@gmail.com
 """
 
+from itertools import product
+try:	# optional, only for batches in Interpolant.many
+	import numpy
+except ImportError:
+	numpy = None
+
 EPS = 1.0e-6
 
 
@@ -30,11 +36,11 @@ def make_n_vectors(k,n):
 
 def v_add(a,b):
 	''' Vector sum'''
-	return map(lambda s,d: s+d, a,b)
+	return [s+d for (s, d) in zip(a,b)]
 
 def v_sub(a,b):
 	''' Vector sub '''
-	return map(lambda s,d: s-d, a,b)
+	return [s-d for (s, d) in zip(a,b)]
 
 def v_len(a):
 	''' Vector length ^ 2 '''
@@ -84,6 +90,17 @@ def Gauss(A, B):
 	return X
 
 
+def m_inverse(A):
+	''' Inverse matrix, found column by column with Gauss '''
+	N=len(A)
+	cols=[Gauss(A, [1.0 if i==j else 0.0 for i in range(N)]) for j in range(N)]
+	return [[cols[j][i] for j in range(N)] for i in range(N)]
+
+def m_v_mul(A,v):
+	''' Matrix by vector multiplication '''
+	return [sum(Aij*vj for (Aij, vj) in zip(Ai, v)) for Ai in A]
+
+
 def v_proj(a,S):
 	''' Projection on a simplex plane.
 
@@ -178,7 +195,7 @@ def v_proj_or(a,S, p0):
 		return to_ret
 
 
-def coords_in_simplex(sx,dot,pnt, xyz,Sx,  crd=[]):
+def coords_in_simplex(sx,dot,pnt, xyz,Sx,  crd=None):
 	''' Determines if a point is in simplex
 
 		Args:
@@ -187,7 +204,7 @@ def coords_in_simplex(sx,dot,pnt, xyz,Sx,  crd=[]):
 			pnt: index of an origin point in simplex.
 			xyz: list of points,
 			Sx: list of point indexes, representing simplicial complex.
-			crd: the return value for calculated coordinates.
+			crd: list to put the calculated coordinates in, if given.
 
 		Returns:
 			'True' if point is in a simplex, 'False' otherwise.
@@ -196,8 +213,6 @@ def coords_in_simplex(sx,dot,pnt, xyz,Sx,  crd=[]):
 	A=make_matrix(DIMM)
 	B=make_vector(DIMM)
 	
-	crd=make_vector(DIMM)
-	
 	cnt=0
 	p_pnt=Sx[sx][pnt]-1
 	for i in range(0,DIMM+1):
@@ -211,7 +226,9 @@ def coords_in_simplex(sx,dot,pnt, xyz,Sx,  crd=[]):
 	for j in range(0,DIMM):
 		B[j]=dot[j]-xyz[p_pnt][j]
 
-	crd=Gauss(A,B)
+	if crd is None:
+		crd=[]
+	crd[:]=Gauss(A,B)
 
 	summ=0.0
 	for j in range(0,DIMM):
@@ -224,22 +241,26 @@ def coords_in_simplex(sx,dot,pnt, xyz,Sx,  crd=[]):
 		return False
 
 
-def get_nearest_simplex(dot,xyz,Sx,sx, best_pack):
+def get_nearest_simplex(dot,xyz,Sx,sx, best_pack, faces=None):
 	''' Finds a simplex which is the nearest to a 'dot' point.
 		Args:
 			sx: A candiate simplex.
 			xyz: List of all points forming simplicial complex.
 			Sx: List of point indexes, representing simplicial complex.
 			best_pack: Structure for passing found data recoursively.
+			faces: Faces of 'xyz' to project with, if any.
 
 		Returns:
 			List, first element of which represents nearest simplex index.
 	'''
 	new_pack=[best_pack[0],copy_vector(best_pack[1]),copy_vector(best_pack[2])]
-	new_S=[]
-	for i in sx:
-		new_S.append(xyz[i-1])
-	new_prj=v_proj_or(dot,new_S, 1.e10)
+	if faces is not None:
+		new_prj=faces.proj_or(dot,[i-1 for i in sx], 1.e10)
+	else:
+		new_S=[]
+		for i in sx:
+			new_S.append(xyz[i-1])
+		new_prj=v_proj_or(dot,new_S, 1.e10)
 	new_l=v_len(v_sub(new_prj,dot))
 	if new_l<best_pack[0]:
 		best_pack[0]=new_l
@@ -249,7 +270,7 @@ def get_nearest_simplex(dot,xyz,Sx,sx, best_pack):
 	if len(sx)>1:
 		for i in range(0,len(sx)):
 			c_sx = sx[:i] + sx[i+1:]
-			best_pack=get_nearest_simplex(dot,xyz,Sx,c_sx, best_pack)
+			best_pack=get_nearest_simplex(dot,xyz,Sx,c_sx, best_pack, faces)
 	return best_pack
 
 
@@ -326,7 +347,7 @@ def F_s(dot, xyz,Sx,base_f,s_k):
 	return F_sex(dot,xyz,Sx,base_f,s_k)
 
 
-def F_sex(dot, xyz,Sx,base_f,s_k):
+def F_sex(dot, xyz,Sx,base_f,s_k, faces=None):
 	''' Simplex weighted extrapolation
 
 		Args:
@@ -336,6 +357,7 @@ def F_sex(dot, xyz,Sx,base_f,s_k):
 			Sx: List of simplexes, represeting simplicial complex
 			base_f: Corresponding to 'xyz' list of basic functions.
 			s_k: Scalar weight function. 
+			faces: Faces of 'xyz' to project with, if any.
 
 		Returns:
 			Value of extrapolation function.
@@ -344,14 +366,14 @@ def F_sex(dot, xyz,Sx,base_f,s_k):
 	for sx in Sx:
 		for i in range(0,len(sx)):
 			c_sx = sx[:i] + sx[i+1:]
-			best_pack=get_nearest_simplex(dot,xyz,Sx,c_sx, best_pack)
+			best_pack=get_nearest_simplex(dot,xyz,Sx,c_sx, best_pack, faces)
 	pnt_set=[]
 	for i in best_pack[2]:
 		pnt_set.append(i-1)
-	return get_inS(dot,best_pack[1],pnt_set,  xyz,Sx,base_f,s_k)
+	return get_inS(dot,best_pack[1],pnt_set,  xyz,Sx,base_f,s_k, faces)
 
 
-def get_inS(dot,prj,pnt_set,  xyz,Sx,base_f,s_k):
+def get_inS(dot,prj,pnt_set,  xyz,Sx,base_f,s_k, faces=None, memo=None):
 	''' Gets a simplex interpolated value in a subsimplex
 
 		Args:
@@ -362,6 +384,9 @@ def get_inS(dot,prj,pnt_set,  xyz,Sx,base_f,s_k):
 			Sx: Simplicial complex.
 			base_f: Corresponding to 'xyz' list of basic functions.
 			s_k: Scalar weight function. 
+			faces: Faces of 'xyz' to project with, if any.
+			memo: Projections and values of the subsimplexes done so far 
+				  for this 'dot', by point set.
 
 		Returns:
 			Iterpolation value for 'dot' projection on a subsimplex
@@ -370,18 +395,23 @@ def get_inS(dot,prj,pnt_set,  xyz,Sx,base_f,s_k):
 	if PSL==1:
 		return base_f[pnt_set[0]](dot)
 	elif PSL>1:
+		if memo is None:
+			memo={}
 		Up=0.0
 		Dn=0.0
 		for i in range(0,PSL):
-			new_pnt_set=[]
-			new_S=[]
-			for j in range(0,PSL):
-				if j!=i:
-					new_pnt_set.append(pnt_set[j]);
-					new_S.append(xyz[pnt_set[j]])
-			new_prj=v_proj(prj,new_S)
+			new_pnt_set=pnt_set[:i] + pnt_set[i+1:]
+			key=frozenset(new_pnt_set)
+			if key in memo:	# projections on nested planes compose, so it is the same whatever the path
+				new_prj, ud=memo[key]
+			else:
+				if faces is not None:
+					new_prj=faces.proj(prj,new_pnt_set)
+				else:
+					new_prj=v_proj(prj,[xyz[j] for j in new_pnt_set])
+				ud=get_inS(dot,new_prj,new_pnt_set,  xyz,Sx,base_f,s_k, faces, memo)
+				memo[key]=(new_prj, ud)
 			cur_k=s_k(v_len(v_sub(new_prj,prj)))
-			ud=get_inS(dot,new_prj,new_pnt_set,  xyz,Sx,base_f,s_k)
 			Up+=ud*cur_k
 			Dn+=cur_k
 		return Up/Dn
@@ -389,6 +419,333 @@ def get_inS(dot,prj,pnt_set,  xyz,Sx,base_f,s_k):
 		raise Exception("error in get_inS")
 
 
+class Faces(object):
+	''' Projection data of simplex faces, made once a face: the face's first
+		point, its edges from that point and the inverse of their Gram matrix.
+
+		Args:
+			xyz: Data points.
+	'''
+	def __init__(self, xyz):
+		self.xyz=xyz
+		self.data={}	# tuple of point indexes -> (origin, edges, inverse Gram matrix)
+
+	def get(self, pnt_set):
+		key=tuple(pnt_set)
+		d=self.data.get(key)
+		if d is None:
+			S=[self.xyz[i] for i in pnt_set]
+			v0i=[v_sub(Si,S[0]) for Si in S[1:]]
+			G=[[sum(a*b for (a, b) in zip(vi, vj)) for vj in v0i] for vi in v0i]
+			d=(S[0], v0i, m_inverse(G) if v0i else [])
+			self.data[key]=d
+		return d
+
+	def coords(self, a, pnt_set):
+		''' Coordinates of the projection of 'a' on a face plane, along the face's edges '''
+		p0, v0i, Gi=self.get(pnt_set)
+		a0=v_sub(a,p0)
+		return m_v_mul(Gi, [sum(x*y for (x, y) in zip(a0, vi)) for vi in v0i])
+
+	def point(self, I, pnt_set):
+		''' The point of a face plane at coordinates 'I' along the face's edges '''
+		p0, v0i, Gi=self.get(pnt_set)
+		to_ret=copy_vector(p0)
+		for (Ii, vi) in zip(I, v0i):
+			to_ret=v_add(to_ret,v_smul(Ii,vi))
+		return to_ret
+
+	def proj(self, a, pnt_set):
+		''' The same as v_proj(a, S) for the face S of 'pnt_set' points '''
+		return self.point(self.coords(a,pnt_set), pnt_set)
+
+	def proj_or(self, a, pnt_set, p0):
+		''' The same as v_proj_or(a, S, p0) for the face S of 'pnt_set' points '''
+		if len(pnt_set)==1:
+			return self.xyz[pnt_set[0]]
+		I=self.coords(a,pnt_set)
+		for i in I:
+			if i<0 or i>1:
+				ret=make_vector(len(a))
+				ret[0]=p0
+				return ret
+		if sum(I)>1:
+			ret=make_vector(len(a))
+			ret[0]=p0
+			return ret
+		return self.point(I,pnt_set)
+
+
+class FaceTree(object):
+	''' Bounding box tree over the faces of a complex, for finding the nearest face
+		to extrapolate on without projecting on every face.
+
+		Args:
+			xyz: Data points.
+			Sx: List of simplexes, represeting simplicial complex
+			faces: Faces of 'xyz' to project with.
+	'''
+	LEAF=8	# faces in a tree leaf
+
+	def __init__(self, xyz, Sx, faces):
+		self.faces=faces
+		self.order=[]	# every face once, as in get_nearest_simplex first visits them
+		seen=set()
+		def visit(sx):
+			key=frozenset(sx)
+			if key in seen:	# and so are all of its faces
+				return
+			seen.add(key)
+			self.order.append(sx)
+			if len(sx)>1:
+				for i in range(0,len(sx)):
+					visit(sx[:i] + sx[i+1:])
+		for sx in Sx:
+			for i in range(0,len(sx)):
+				visit(sx[:i] + sx[i+1:])
+		self.pnts=[[i-1 for i in sx] for sx in self.order]
+		self.lo=[]
+		self.hi=[]
+		for pnt_set in self.pnts:
+			faces.get(pnt_set)
+			S=[xyz[i] for i in pnt_set]
+			self.lo.append([min(p[j] for p in S) for j in range(len(S[0]))])
+			self.hi.append([max(p[j] for p in S) for j in range(len(S[0]))])
+		self.root=self._build(list(range(len(self.order)))) if self.order else None
+
+	def _build(self, ids):
+		DIMM=len(self.lo[ids[0]])
+		lo=[min(self.lo[i][j] for i in ids) for j in range(DIMM)]
+		hi=[max(self.hi[i][j] for i in ids) for j in range(DIMM)]
+		if len(ids)<=self.LEAF:
+			return (lo, hi, ids, None)
+		axis=max(range(DIMM), key=lambda j: hi[j]-lo[j])
+		ids.sort(key=lambda i: self.lo[i][axis]+self.hi[i][axis])
+		m=len(ids)//2
+		return (lo, hi, self._build(ids[:m]), self._build(ids[m:]))
+
+	def nearest(self, dot):
+		''' The same [distance, projection, face] as get_nearest_simplex finds for all the faces '''
+		best=[1.e10,[],[],-1]
+		if self.root is not None:
+			self._search(self.root, dot, best)
+		return best[:3]
+
+	def _search(self, node, dot, best):
+		lo, hi, a, b=node
+		if b is None:
+			for i in a:
+				prj=self.faces.proj_or(dot,self.pnts[i], 1.e10)
+				l=v_len(v_sub(prj,dot))
+				if l<best[0] or (l==best[0] and i<best[3]):	# ties go to the first visited face
+					best[:]=[l,prj,self.order[i],i]
+			return
+		for (d, node) in sorted([(_box_distance(dot, c[0], c[1]), c) for c in (a, b)], key=lambda dc: dc[0]):
+			if d<=best[0]*(1.0+1.0e-9)+1.0e-12:	# with a margin for rounding
+				self._search(node, dot, best)
+
+
+def _box_distance(dot, lo, hi):
+	return v_len([max(l-x, 0, x-h) for (x, l, h) in zip(dot, lo, hi)])
+
+
+class SimplexIndex(object):
+	''' Uniform grid over the simplexes' bounding boxes, about a simplex per cell.
+
+		Args:
+			xyz: Data points.
+			Sx: List of simplexes, represeting simplicial complex
+	'''
+	def __init__(self, xyz, Sx):
+		DIMM=len(xyz[0]) if xyz else 0
+		self.lo=[min(p[j] for p in xyz) for j in range(DIMM)]
+		self.hi=[max(p[j] for p in xyz) for j in range(DIMM)]
+		ext=[h-l for (l, h) in zip(self.lo, self.hi)]
+		self.pad=[e*1.0e-9+1.0e-12 for e in ext]	# so rounding never puts a point out of its simplex's cells
+		flat=[e for e in ext if e>0]
+		volume=1.0
+		for e in flat:
+			volume*=e
+		side=(volume/max(len(Sx), 1))**(1.0/len(flat)) if flat else 1.0
+		self.n=[max(1, int(round(e/side))) for e in ext]	# cells along each axis
+		self.size=[(e+2*p)/n for (e, p, n) in zip(ext, self.pad, self.n)]
+		self.cells={}
+		for (sx, pnts) in enumerate(Sx):
+			S=[xyz[pnt-1] for pnt in pnts]
+			c_lo=self.cell([min(p[j] for p in S) for j in range(DIMM)])
+			c_hi=self.cell([max(p[j] for p in S) for j in range(DIMM)])
+			for c in product(*[range(a, b+1) for (a, b) in zip(c_lo, c_hi)]):
+				self.cells.setdefault(c, []).append(sx)
+
+	def cell(self, dot):
+		''' Grid cell of a point, clamped to the grid '''
+		return tuple(min(max(int((x-l+p)/size), 0), n-1) for (x, l, p, size, n) in zip(dot, self.lo, self.pad, self.size, self.n))
+
+	def candidates(self, dot):
+		''' Indexes of the simplexes that may contain 'dot', in 'Sx' order '''
+		for (x, l, h, p) in zip(dot, self.lo, self.hi, self.pad):
+			if x<l-p or x>h+p:
+				return []
+		return self.cells.get(self.cell(dot), [])
+
+
+class Interpolant(object):
+	''' Simplicial weighted interpolation and extrapolation of a data set,
+		with the simplex search done through a SimplexIndex
+		and the nearest face search through a FaceTree.
+
+		Args:
+			xyz: Data points.
+			Sx: List of simplexes, represeting simplicial complex
+			base_f: Corresponding to 'xyz' list of basic functions.
+			s_k: Scalar weight function. 
+	'''
+	BATCH=8	# fewer points a simplex are faster without NumPy, it starts to pay at 4 to 8
+
+	def __init__(self, xyz, Sx, base_f, s_k):
+		self.xyz=xyz
+		self.Sx=Sx
+		self.base_f=base_f
+		self.s_k=s_k
+		self.index=SimplexIndex(xyz, Sx)
+		self.faces=Faces(xyz)
+		self.tree=FaceTree(xyz, Sx, self.faces)
+		self.inverse=[]	# for each simplex, its first point and the inverse of its edge matrix
+		for pnts in Sx:
+			p0=xyz[pnts[0]-1]
+			A=[[xyz[pnt-1][j]-p0[j] for pnt in pnts[1:]] for j in range(len(p0))]
+			self.inverse.append((p0, m_inverse(A)))
+
+	def coords(self, sx, dot):
+		''' Barycentric coordinates of 'dot' in simplex 'sx', one per point '''
+		p0, Ai=self.inverse[sx]
+		crd=m_v_mul(Ai, v_sub(dot,p0))
+		return [1.0-sum(crd)]+crd
+
+	def contains(self, sx, dot, eps=1.0e-12):
+		''' If 'dot' is in simplex 'sx', up to 'eps' in barycentric coordinates '''
+		for c in self.coords(sx, dot):
+			if c<-eps or c>1.0+eps:
+				return False
+		return True
+
+	def inside(self, sx, dot, eps=1.0e-12):
+		''' If 'dot' is in simplex 'sx' and off its boundary by more than 'eps' '''
+		for c in self.coords(sx, dot):
+			if c<eps or c>1.0-eps:
+				return False
+		return True
+
+	def locate(self, dot):
+		''' Index of the first simplex in 'Sx' with 'dot' in it, -1 if there is none '''
+		for sx in self.index.candidates(dot):
+			if self.contains(sx, dot):
+				return sx
+		return -1
+
+	def __call__(self, dot):
+		''' The same as F_s(dot, xyz,Sx,base_f,s_k) '''
+		sx=self.locate(dot)
+		if sx<0:
+			l, prj, face=self.tree.nearest(dot)
+			pnt_set=[pnt-1 for pnt in face]
+			return get_inS(dot,prj,pnt_set,  self.xyz,self.Sx,self.base_f,self.s_k, self.faces)
+		pnt_set=[pnt-1 for pnt in self.Sx[sx]]
+		return get_inS(dot,dot,pnt_set,  self.xyz,self.Sx,self.base_f,self.s_k, self.faces)
+
+	def many(self, points):
+		''' The same as [self(dot) for dot in points], up to rounding.
+			A point is first tried in the simplex of the point before it, which is
+			taken if the point is off its boundary, as no other simplex may have it then
+			for a complex of non-overlapping simplexes. The points are then done
+			a simplex or a nearest face at a time, with NumPy if there is one
+			and there are at least BATCH points.
+		'''
+		batches={}	# point set of a simplex or a nearest face -> [(point number, its projection)]
+		last=-1
+		for (n, dot) in enumerate(points):
+			if last<0 or not self.inside(last, dot):
+				last=self.locate(dot)
+			if last>=0:
+				batches.setdefault(tuple(self.Sx[last]), []).append((n, dot))
+			else:
+				l, prj, face=self.tree.nearest(dot)
+				batches.setdefault(tuple(face), []).append((n, prj))
+		values=[0.0]*len(points)
+		for (face, batch) in batches.items():
+			pnt_set=[pnt-1 for pnt in face]
+			if numpy is not None and len(batch)>=self.BATCH:
+				done=self._batch([points[n] for (n, prj) in batch], numpy.array([prj for (n, prj) in batch], dtype=float), pnt_set, {})
+				for ((n, prj), value) in zip(batch, done.tolist()):
+					values[n]=value
+			else:
+				for (n, prj) in batch:
+					values[n]=get_inS(points[n],prj,pnt_set,  self.xyz,self.Sx,self.base_f,self.s_k, self.faces)
+		return values
+
+	def _batch(self, dots, P, pnt_set, memo):	# get_inS for all the 'dots' at once, P being their projections
+		if len(pnt_set)==1:
+			return numpy.array([self.base_f[pnt_set[0]](dot) for dot in dots], dtype=float)
+		Up=numpy.zeros(len(dots))
+		Dn=numpy.zeros(len(dots))
+		for i in range(0,len(pnt_set)):
+			new_pnt_set=pnt_set[:i] + pnt_set[i+1:]
+			key=frozenset(new_pnt_set)
+			if key not in memo:
+				p0, v0i, Gi=self.faces.get(new_pnt_set)
+				new_P=numpy.array(p0, dtype=float)
+				if v0i:
+					V=numpy.array(v0i, dtype=float)
+					new_P=new_P+(P-new_P).dot(V.T).dot(numpy.array(Gi, dtype=float).T).dot(V)
+				memo[key]=(new_P, self._batch(dots, new_P, new_pnt_set, memo))
+			new_P, ud=memo[key]
+			cur_k=numpy.array([self.s_k(l) for l in ((new_P-P)**2).sum(axis=1).tolist()], dtype=float)
+			Up+=ud*cur_k
+			Dn+=cur_k
+		return Up/Dn
+
+	def grid(self, axes):
+		''' Values on a grid, nested as the axes go: grid([xs, ys])[i][j] is self([xs[i], ys[j]]) '''
+		axes=[list(a) for a in axes]
+		values=self.many([list(dot) for dot in product(*axes)])
+		for a in reversed(axes[1:]):
+			values=[values[i:i+len(a)] for i in range(0, len(values), len(a))] if a else []
+		return values
+
+
+def F_s_many(points, xyz,Sx,base_f,s_k):
+	''' Simplicial weighted interpolation for many points at once
+
+		Args:
+			points: List of arguments for interpolation function, 
+					better with the neighbouring ones next to each other.
+			xyz: Data points.
+			Sx: List of simplexes, represeting simplicial complex
+			base_f: Corresponding to 'xyz' list of basic functions.
+			s_k: Scalar weight function. 
+
+		Returns:
+			List of values, the same as F_s gives for each point up to rounding.
+	'''
+	return Interpolant(xyz,Sx,base_f,s_k).many(points)
+
+
+def F_s_grid(axes, xyz,Sx,base_f,s_k):
+	''' Simplicial weighted interpolation on a grid
+
+		Args:
+			axes: List of coordinates along each axis.
+			xyz: Data points.
+			Sx: List of simplexes, represeting simplicial complex
+			base_f: Corresponding to 'xyz' list of basic functions.
+			s_k: Scalar weight function. 
+
+		Returns:
+			Values nested as the axes go: for [xs, ys], value at [xs[i], ys[j]] is [i][j].
+	'''
+	return Interpolant(xyz,Sx,base_f,s_k).grid(axes)
+
+
 
 if __name__ == '__main__':
 	''' testing and demonstration part '''
@@ -430,21 +787,16 @@ if __name__ == '__main__':
 	def test_1d():
 		canvas1 = new_bitmap(256, 256)
 		start_time = time.time()
-		ox='none'
-		oy='none'
-		for i in range(len(s1)):	# for all simplexes
-			the_fill = colors(i)
-			if i>0 and i<len(s1)-1: # these simplexes are to grant smoothness only
-				for j in range(21):
-					ti1 = t[s1[i][0]-1][0]
-					ti2 = t[s1[i][1]-1][0]
-					ti = ti1 + j*(ti2 - ti1)/20.0
-					F_x=F([ti], t, s1, fxi, k)
-					F_y=F([ti], t, s1, fyi, k)
-					if ox!='none' and oy!='none':
-						line_on(canvas1, F_x, F_y, ox, oy, the_fill, width=2)
-					ox = F_x
-					oy = F_y
+		last = None
+		for i in range(1, len(s1)-1):	# the first and the last simplexes are to grant smoothness only
+			ti1 = t[s1[i][0]-1][0]
+			ti2 = t[s1[i][1]-1][0]
+			points = [last] if last else []	# the curve goes on from where the previous simplex ended
+			for j in range(len(points), 21):
+				ti = ti1 + j*(ti2 - ti1)/20.0
+				points.append((Fx([ti]), Fy([ti])))
+			polyline_on(canvas1, points, colors(i), width=2)
+			last = points[-1]
 				
 		finish_time=time.time()	 # geting and printing calculation time
 		the_time = finish_time - start_time
@@ -455,17 +807,18 @@ if __name__ == '__main__':
 		canvas2 = new_bitmap(256, 256)
 		start_time = time.time()
 
+		values = F.grid([range(100), range(100)])
 		for i in range(100): # quasi-isometric plot
 			for j in range(100):
 				p = [i, j]
-				F_xy = F(p, xy, s2, fi, k)
+				F_xy = values[i][j]
 				xb = 128 + i - j
 				yb = 140 + (i + j) / 2
 				line_on(canvas2, xb, yb, xb, yb-F_xy, "#800")
 
 				current_simplex = -1 # determining in which simplex p lies
-				for s in range(len(s2)):
-					if coords_in_simplex(s, p, 0,  xy, s2):
+				for s in F.index.candidates(p):
+					if F.contains(s, p):
 						current_simplex = s
 
 				the_fill = colors(current_simplex)
@@ -488,22 +841,22 @@ if __name__ == '__main__':
 		canvas3 = new_bitmap(256, 256)
 		start_time = time.time()
 
+		top = F.grid([range(100), range(100), [100]])	# top[j][i][0] is at [j, i, 100]
+		side = F.grid([range(100, 0, -1), [100], range(100, 0, -1)])	# side[i][0][j] is at [100-i, 100, 100-j]
+		front = F.grid([[100], range(100, 0, -1), range(100, 0, -1)])	# front[0][i][j] is at [100, 100-i, 100-j]
 		for i in range(100): 
 			for j in range(100):
-				p = [j, i, 100]
-				F_xyz = F(p, xyz, s3, fi, k)
+				F_xyz = top[j][i][0]
 				xb = 128 + i - j
 				yb = 29 + (i + j) / 2
 				pixel_on(canvas3, xb, yb, red(F_xyz, 50))
 
-				p = [100-i, 100, 100-j]
-				F_xyz = F(p, xyz, s3, fi, k)
+				F_xyz = side[i][0][j]
 				xb = 128 + i
 				yb = 128 + j - i / 2
 				pixel_on(canvas3, xb, yb, red(F_xyz, 30))
 
-				p = [100, 100-i, 100-j]
-				F_xyz = F(p, xyz, s3, fi, k)
+				F_xyz = front[0][i][j]
 				xb = 128 - i
 				yb = 128 + j - i / 2
 				pixel_on(canvas3, xb, yb, red(F_xyz, 0))
@@ -518,17 +871,18 @@ if __name__ == '__main__':
 
 	ret_html = ""
 
-	F = F_s	   # interpolation scheme
 	fxi = get_linear_functions(t, x, s1) # basis functions
 	fyi = get_linear_functions(t, y, s1) # basis functions
+	Fx = Interpolant(t, s1, fxi, k)	   # interpolation scheme
+	Fy = Interpolant(t, s1, fyi, k)
 	ret_html += test_1d()   # curve test
 
-	F = F_s # interpolation scheme
 	fi = get_linear_functions(xy, f_xy, s2) # basis functions
+	F = Interpolant(xy, s2, fi, k) # interpolation scheme
 	ret_html += test_2d()   # surface test
 
-	F = F_s # interpolation scheme
 	fi = get_linear_functions(xyz, f_xyz, s3) # basis functions
+	F = Interpolant(xyz, s3, fi, k) # interpolation scheme
 	ret_html += test_3d()   # 3-manifold test
 
 	print( ret_html )
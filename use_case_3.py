@@ -90,10 +90,12 @@ if __name__ == "__main__":
 	orths_on( bmp2 )
 	orths_on( bmp3 )
 
-	for i in range(1,500):
-		line_on(bmp1, i, y_to_sy( px(pol1, sx_to_x(i)) ), i-1, y_to_sy( px(pol1, sx_to_x(i-1)) ), '#700')
-		line_on(bmp2, i, y_to_sy( px(pol2, sx_to_x(i)) ), i-1, y_to_sy( px(pol2, sx_to_x(i-1)) ), '#060')
-		line_on(bmp3, i, y_to_sy( px(pol3, sx_to_x(i)) ), i-1, y_to_sy( px(pol3, sx_to_x(i-1)) ), '#007')
+	def to_screen( x, y ):
+		return x_to_sx( x ), y_to_sy( y )
+
+	plot_function(bmp1, lambda x: px(pol1, x), sx_to_x(0), sx_to_x(499), to_screen, '#700')
+	plot_function(bmp2, lambda x: px(pol2, x), sx_to_x(0), sx_to_x(499), to_screen, '#060')
+	plot_function(bmp3, lambda x: px(pol3, x), sx_to_x(0), sx_to_x(499), to_screen, '#007')
 
 	print( to_html( bmp1 ) )
 	print( pol1, pol_roots( pol1 ) )